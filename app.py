@@ -1,45 +1,436 @@
 from flask import Flask, request, jsonify
 from flask_cors import CORS
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.sansio.multipart import Data, Epilogue, Field, File, MultipartDecoder, NeedData
 import os
 import base64
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import json
+import codecs
 import csv
+import itertools
+import math
+import multiprocessing
+import re
+import select
+import socket
+import sqlite3
+import ssl
+import tarfile
+import tempfile
+import threading
+import time
+import uuid
+import sys
+from array import array
 from io import StringIO
-from datetime import datetime, timedelta
-from collections import defaultdict
+from urllib.parse import unquote, urlparse
+from operator import itemgetter
+from datetime import date, datetime
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 import hashlib
+import hmac
+import ipaddress
+
+try:
+    import numpy as np
+except ImportError:  # optional: only speeds up group-by counts on large rebuilds
+    np = None
+
+try:
+    import fcntl
+except ImportError:  # Windows: queued submissions are only claimed within one process
+    fcntl = None
+
+ALLOWED_ORIGINS = ['https://thewatchindex.org']
 
 app = Flask(__name__)
-CORS(app, origins=['https://thewatchindex.org'])
+CORS(app, origins=ALLOWED_ORIGINS)
+
+class ExpiringStore:
+    """In-memory rate-limit counters that each expire a fixed TTL after creation.
+
+    Entries (key -> [expiry, count]) live in an OrderedDict in creation
+    order. With a single TTL that is also expiry order, so expired entries
+    are swept lazily from the front on each call; insert, lookup and
+    expiry are amortized O(1). The store never holds more than
+    max_entries keys: on overflow the oldest entry (the one closest to
+    expiring) is evicted, which lets that key back in early rather than
+    refusing everyone else.
+    """
+
+    def __init__(self, ttl, max_entries):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _sweep(self, now):
+        entries = self._entries
+        while entries:
+            key, entry = next(iter(entries.items()))
+            if entry[0] > now:
+                break
+            del entries[key]
+
+    def acquire(self, limits, now=None):
+        """Count one request against every key, if all are under their limit.
+
+        Args:
+            limits: List of (key, limit) pairs, e.g. one per address level.
+            now: time.monotonic() timestamp, defaults to the current time.
+
+        Returns:
+            0 if the request was counted, otherwise the seconds until the
+            latest-expiring exhausted key frees up (nothing is counted).
+        """
+        if now is None:
+            now = time.monotonic()
+        with self._lock:
+            self._sweep(now)
+            entries = self._entries
+            # After the sweep every remaining entry is unexpired
+            wait = 0
+            for key, limit in limits:
+                entry = entries.get(key)
+                if entry is not None and entry[1] >= limit:
+                    wait = max(wait, entry[0] - now)
+            if wait > 0:
+                return wait
+            for key, _ in limits:
+                entry = entries.get(key)
+                if entry is None:
+                    entries[key] = [now + self.ttl, 1]
+                else:
+                    entry[1] += 1
+            while len(entries) > self.max_entries:
+                entries.popitem(last=False)
+            return 0
+
+
+class SQLiteRateLimiter:
+    """Rate-limit backend in a SQLite file shared by every process on a host.
+
+    Each acquire is one IMMEDIATE transaction: it reads the counters of
+    all levels, and only if none is exhausted increments them (restarting
+    any whose window has passed), so concurrent processes never both get
+    the last slot.
+    """
+
+    # Expired rows are deleted once every this many acquires.
+    PURGE_EVERY = 1000
+
+    def __init__(self, path, ttl):
+        self.ttl = ttl
+        self._db = sqlite3.connect(path, timeout=5, isolation_level=None, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS rate_limit_counters "
+            "(key TEXT PRIMARY KEY, expires REAL NOT NULL, count INTEGER NOT NULL)"
+        )
+        self._lock = threading.Lock()
+        self._calls = 0
+
+    def acquire(self, limits):
+        """Same contract as ExpiringStore.acquire(), across processes."""
+        now = time.time()
+        keys = [f"{key:x}" for key, _ in limits]
+        with self._lock:
+            db = self._db
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                stored = dict((key, (expires, count)) for key, expires, count in db.execute(
+                    f"SELECT key, expires, count FROM rate_limit_counters "
+                    f"WHERE key IN ({','.join('?' * len(keys))}) AND expires > ?",
+                    (*keys, now),
+                ))
+                wait = 0
+                for key, (_, limit) in zip(keys, limits):
+                    if key in stored and stored[key][1] >= limit:
+                        wait = max(wait, stored[key][0] - now)
+                if wait <= 0:
+                    db.executemany(
+                        "INSERT INTO rate_limit_counters (key, expires, count) VALUES (?, ?, 1) "
+                        "ON CONFLICT (key) DO UPDATE SET "
+                        "count = CASE WHEN expires > ?3 THEN count + 1 ELSE 1 END, "
+                        "expires = CASE WHEN expires > ?3 THEN expires ELSE excluded.expires END",
+                        [(key, now + self.ttl, now) for key in keys],
+                    )
+                self._calls += 1
+                if self._calls % self.PURGE_EVERY == 0:
+                    db.execute("DELETE FROM rate_limit_counters WHERE expires <= ?", (now,))
+                db.execute("COMMIT")
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+        return max(wait, 0)
+
+
+class RedisError(Exception):
+    """An error reply from the Redis server."""
+
+
+class RedisRateLimiter:
+    """Rate-limit backend on any server speaking the Redis protocol (RESP).
+
+    An acquire is one MULTI/EXEC transaction, sent in a single write, that
+    for every level starts the counter if it is missing (``SET NX PX``),
+    counts the request (``INCR``) and reads the time left (``PTTL``).
+    Only these basic commands are used, so simple RESP stand-ins work as
+    well as Redis itself. Counting first keeps the check atomic: if any
+    level turns out to be over its limit, the counts are taken back with
+    ``DECR``; until then a concurrent request may see them one too high
+    and be turned away early, never let through. The client is a
+    minimal RESP implementation over one persistent socket; ``rediss://``
+    URLs use TLS.
+    """
+
+    def __init__(self, url, ttl, prefix='ratelimit:', timeout=2.0):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or 'localhost'
+        self.port = parsed.port or 6379
+        self.tls = parsed.scheme == 'rediss'
+        self.username = unquote(parsed.username) if parsed.username else None
+        self.password = unquote(parsed.password) if parsed.password else None
+        self.db = int(parsed.path.lstrip('/') or 0)
+        self.ttl = ttl
+        self.prefix = prefix
+        self.timeout = timeout
+        self._sock = None
+        self._reader = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _encode(*args):
+        out = [b'*%d\r\n' % len(args)]
+        for arg in args:
+            if not isinstance(arg, bytes):
+                arg = str(arg).encode('utf-8')
+            out.append(b'$%d\r\n%s\r\n' % (len(arg), arg))
+        return b''.join(out)
+
+    def _read_reply(self):
+        line = self._reader.readline()
+        if not line.endswith(b'\r\n'):
+            raise ConnectionError("connection closed by the Redis server")
+        kind, payload = line[:1], line[1:-2]
+        if kind == b'+':
+            return payload.decode('utf-8')
+        if kind == b'-':
+            raise RedisError(payload.decode('utf-8', errors='replace'))
+        if kind == b':':
+            return int(payload)
+        if kind == b'$':
+            length = int(payload)
+            if length < 0:
+                return None
+            data = self._reader.read(length + 2)
+            return data[:-2]
+        if kind == b'*':
+            length = int(payload)
+            return None if length < 0 else [self._read_reply() for _ in range(length)]
+        raise RedisError(f"unexpected reply {line!r}")
+
+    def _connect(self):
+        sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        if self.tls:
+            sock = ssl.create_default_context().wrap_socket(sock, server_hostname=self.host)
+        self._sock, self._reader = sock, sock.makefile('rb')
+        setup = []
+        if self.password is not None:
+            setup.append(('AUTH', self.username, self.password) if self.username else ('AUTH', self.password))
+        if self.db:
+            setup.append(('SELECT', self.db))
+        if setup:
+            self._pipeline(setup)
+
+    def _close(self):
+        if self._sock is not None:
+            try:
+                self._sock.close()
+            except OSError:
+                pass
+        self._sock = self._reader = None
+
+    def _pipeline(self, commands):
+        self._sock.sendall(b''.join(self._encode(*command) for command in commands))
+        return [self._read_reply() for _ in commands]
+
+    def execute(self, *commands):
+        """Send commands in one write and return their replies.
+
+        A connection the server has closed while idle is noticed before
+        anything is written to it and reopened. Once a batch has been
+        sent it is never sent again, since the server may already have
+        run it: any failure from then on is raised.
+        """
+        with self._lock:
+            # An idle connection only becomes readable when the server closed it
+            if self._sock is not None and select.select([self._sock], [], [], 0)[0]:
+                self._close()
+            try:
+                if self._sock is None:
+                    self._connect()
+                return self._pipeline(commands)
+            except (OSError, RedisError):
+                self._close()
+                raise
+
+    def acquire(self, limits):
+        """Same contract as ExpiringStore.acquire(), across instances."""
+        ttl_ms = int(self.ttl * 1000)
+        keys = [f"{self.prefix}{key:x}" for key, _ in limits]
+        commands = [('MULTI',)]
+        for key in keys:
+            commands += [('SET', key, 0, 'NX', 'PX', ttl_ms), ('INCR', key), ('PTTL', key)]
+        commands.append(('EXEC',))
+        results = self.execute(*commands)[-1]
+        if results is None:
+            raise RedisError("transaction aborted")
+        counts, ttls = results[1::3], results[2::3]
+
+        wait = 0
+        for count, ttl, (_, limit) in zip(counts, ttls, limits):
+            if count > limit:
+                wait = max(wait, ttl, 1)
+        followup = []
+        if wait > 0:
+            followup += [('DECR', key) for key in keys]
+        # A counter without an expiry (e.g. one a DECR recreated just after
+        # it expired) would never reset; give it a fresh window
+        followup += [('PEXPIRE', key, ttl_ms) for key, ttl in zip(keys, ttls) if ttl < 0]
+        if followup:
+            try:
+                self.execute(*followup)
+            except (OSError, RedisError) as e:
+                print(f"Could not settle rate-limit counters: {e}")
+        return wait / 1000
+
+
+class CachedRateLimiter:
+    """Front a shared rate-limit backend with in-process shortcuts.
+
+    Rejections are remembered until they expire (up to max_rejections
+    keys, oldest dropped first), so a client hammering the endpoint is
+    turned away without a remote call. If the backend fails, this
+    instance falls back to an in-memory ExpiringStore rather than either
+    rejecting everyone or letting everyone through.
+    """
+
+    def __init__(self, backend, fallback, max_rejections=4096):
+        self.backend = backend
+        self.fallback = fallback
+        self.max_rejections = max_rejections
+        self._rejected = OrderedDict()
+        self._lock = threading.Lock()
+
+    def clear(self):
+        with self._lock:
+            self._rejected.clear()
+        self.fallback.clear()
+
+    def acquire(self, limits):
+        # Rejections are remembered per most specific key (the client's own)
+        key = limits[0][0]
+        now = time.monotonic()
+        with self._lock:
+            until = self._rejected.get(key)
+            if until is not None:
+                if until > now:
+                    return until - now
+                del self._rejected[key]
+        try:
+            wait = self.backend.acquire(limits)
+        except (OSError, sqlite3.Error, RedisError) as e:
+            print(f"Rate limit backend unavailable, limiting in memory: {e}")
+            return self.fallback.acquire(limits, now)
+        if wait > 0:
+            with self._lock:
+                self._rejected[key] = now + wait
+                self._rejected.move_to_end(key)
+                if len(self._rejected) > self.max_rejections:
+                    self._rejected.popitem(last=False)
+        return wait
+
+
+# Where rate-limit state lives: "memory" (per instance), "sqlite" (a file
+# shared by processes on one host) or "redis" (shared by all instances).
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory")
+RATE_LIMIT_SECONDS = 24 * 3600  # 1 submission per 24 hours per IP
+# Submissions per 24 hours from one IPv4 /24 or IPv6 /48. A single IPv6 /64
+# is one subscriber and gets the same single submission as an IPv4 address.
+RATE_LIMIT_NETWORK_MAX = int(os.getenv("RATE_LIMIT_NETWORK_MAX", "20"))
+
+
+def _rate_limit_store():
+    memory = ExpiringStore(RATE_LIMIT_SECONDS, int(os.getenv("RATE_LIMIT_MAX_ENTRIES", "100000")))
+    if RATE_LIMIT_BACKEND == 'sqlite':
+        path = os.getenv("RATE_LIMIT_SQLITE_PATH",
+                         os.path.join(tempfile.gettempdir(), "watch-index-ratelimit.sqlite3"))
+        return CachedRateLimiter(SQLiteRateLimiter(path, RATE_LIMIT_SECONDS), memory)
+    if RATE_LIMIT_BACKEND == 'redis':
+        url = os.getenv("RATE_LIMIT_REDIS_URL") or os.getenv("REDIS_URL", "redis://localhost:6379/0")
+        return CachedRateLimiter(RedisRateLimiter(url, RATE_LIMIT_SECONDS), memory)
+    return memory
+
+
+# Rate limiting store (address prefix -> submissions in the current window).
+# With the default in-memory backend this resets when the serverless
+# function restarts and is per instance, but that's acceptable for low
+# traffic.
+rate_limit_store = _rate_limit_store()
+
+
+def rate_limit_keys(ip_address):
+    """Return the (key, limit) pairs an address is counted against.
+
+    Keys are packed integers ``prefix length << 128 | network``: the host
+    (/32 or /64) with a limit of 1, then its network (/24 or /48) with a
+    limit of RATE_LIMIT_NETWORK_MAX. IPv4-mapped IPv6 addresses count as
+    IPv4. Anything that doesn't parse as an address is keyed by a hash of
+    the string with a limit of 1.
+    """
+    try:
+        address = ipaddress.ip_address(ip_address)
+    except ValueError:
+        digest = hashlib.sha256(str(ip_address).encode('utf-8')).digest()
+        return [(255 << 128 | int.from_bytes(digest[:16], 'big'), 1)]
+    if address.version == 6 and address.ipv4_mapped is not None:
+        address = address.ipv4_mapped
+    value, bits = int(address), address.max_prefixlen
+    host, network = (32, 24) if bits == 32 else (64, 48)
+    return [
+        (host << 128 | value >> (bits - host) << (bits - host), 1),
+        (network << 128 | value >> (bits - network) << (bits - network), RATE_LIMIT_NETWORK_MAX),
+    ]
 
-# In-memory rate limiting store (IP -> last submission timestamp)
-# Note: This resets when the serverless function restarts, but that's acceptable
-rate_limit_store = {}
 
 def check_rate_limit(ip_address):
     """Check if an IP address has exceeded the rate limit.
     
+    The address's own limit (one submission per /32 or /64) and its
+    network's (/24 or /48) are checked and counted in a single call to
+    the store.
+    
     Args:
         ip_address: The IP address to check
     
     Returns:
         Tuple (allowed: bool, wait_time: int) - wait_time in seconds if not allowed
     """
-    now = datetime.utcnow()
-    rate_limit_hours = 24  # 1 submission per 24 hours per IP
-    
-    if ip_address in rate_limit_store:
-        last_submission = rate_limit_store[ip_address]
-        time_diff = now - last_submission
-        required_wait = timedelta(hours=rate_limit_hours)
-        
-        if time_diff < required_wait:
-            wait_seconds = int((required_wait - time_diff).total_seconds())
-            return False, wait_seconds
-    
-    # Update the rate limit store
-    rate_limit_store[ip_address] = now
+    wait_seconds = rate_limit_store.acquire(rate_limit_keys(ip_address))
+    if wait_seconds > 0:
+        return False, int(wait_seconds)
     return True, 0
 
 
@@ -92,260 +483,2315 @@ def validate_submission_data(data):
         return False, f"Invalid data format: {str(e)}"
 
 
-def get_csv_files_from_github():
-    """Fetch all CSV files from the submissions directory on GitHub.
-    
+# Base URL of the GitHub REST API; override to point at a local stand-in.
+GITHUB_API_URL = os.getenv("GITHUB_API_URL", "https://api.github.com").rstrip('/')
+
+# How a rebuild reads the archive: "contents" lists submissions/ and fetches
+# each file, "archive" streams the repository tarball in a single request.
+INGEST_MODE = os.getenv("AGGREGATE_INGEST_MODE", "contents")
+
+# Maximum number of submission files downloaded in parallel.
+FETCH_CONCURRENCY = max(1, int(os.getenv("GITHUB_FETCH_CONCURRENCY", "16")))
+
+# Worker processes that parse and aggregate a full rebuild; 1 aggregates in
+# this process, 0 uses one per CPU. Serverless hosts generally can't fork.
+REBUILD_PROCESSES = int(os.getenv("REBUILD_PROCESSES", "1")) or os.cpu_count() or 1
+
+class GitHubClient:
+    """Connection-pooled client for all GitHub API traffic.
+
+    Wraps a single requests.Session so every call reuses keep-alive
+    connections from one sized HTTPAdapter pool, and keeps the default
+    headers, (connect, read) timeouts and retry policy in one place.
+    Idempotent requests are retried with backoff on connection errors and
+    5xx responses; writes are only retried when the connection failed
+    before anything was sent.
+
+    GETs are revalidated with If-None-Match against a small LRU of earlier
+    responses. GitHub answers an unchanged resource with 304 Not Modified,
+    which does not count against the rate limit, and the cached 200
+    response is returned in its place.
+
+    Credentials and the target repository are read from the environment
+    on each call.
+    """
+
+    ETAG_CACHE_MAX_ENTRIES = 64
+
+    def __init__(self, api_url, pool_size, timeout=(5, 30), retries=3):
+        self.api_url = api_url
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers.update({
+            "Accept": "application/vnd.github+json",
+            "User-Agent": "watch-index-backend",
+        })
+        retry = Retry(
+            total=retries,
+            backoff_factor=0.5,
+            status_forcelist=(500, 502, 503, 504),
+            allowed_methods=frozenset({"GET", "HEAD"}),
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=retry)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        # (url, params) -> last 200 response with an ETag, least recently used first
+        self._etag_cache = OrderedDict()
+        self._etag_lock = threading.Lock()
+
+    @property
+    def configured(self):
+        """Whether GITHUB_TOKEN and REPO_FULL_NAME are both set."""
+        return bool(os.getenv("GITHUB_TOKEN") and os.getenv("REPO_FULL_NAME"))
+
+    def url(self, path):
+        """Return the API URL of a path under the repository, e.g. ``/git/trees/main``."""
+        return f"{self.api_url}/repos/{os.getenv('REPO_FULL_NAME')}{path}"
+
+    def request(self, method, path, headers=None, **kwargs):
+        """Send a request to a path under the repository."""
+        request_headers = {"Authorization": f"token {os.getenv('GITHUB_TOKEN')}"}
+        request_headers.update(headers or {})
+        kwargs.setdefault('timeout', self.timeout)
+        return self.session.request(method, self.url(path), headers=request_headers, **kwargs)
+
+    def get(self, path, params=None, headers=None, conditional=True, **kwargs):
+        """GET a path, revalidating a cached copy unless conditional is False.
+
+        Returns:
+            The requests.Response (possibly a replayed cached one).
+        """
+        if not conditional or kwargs.get('stream'):
+            return self.request("GET", path, headers=headers, params=params, **kwargs)
+
+        key = (self.url(path), tuple(sorted((params or {}).items())))
+        with self._etag_lock:
+            cached = self._etag_cache.get(key)
+        request_headers = dict(headers or {})
+        if cached is not None:
+            request_headers['If-None-Match'] = cached.headers['ETag']
+
+        response = self.request("GET", path, headers=request_headers, params=params, **kwargs)
+        with self._etag_lock:
+            if response.status_code == 304 and cached is not None:
+                if key in self._etag_cache:
+                    self._etag_cache.move_to_end(key)
+                return cached
+            if response.status_code == 200 and response.headers.get('ETag'):
+                self._etag_cache[key] = response
+                self._etag_cache.move_to_end(key)
+                while len(self._etag_cache) > self.ETAG_CACHE_MAX_ENTRIES:
+                    self._etag_cache.popitem(last=False)
+            else:
+                self._etag_cache.pop(key, None)
+        return response
+
+    def put(self, path, json=None, **kwargs):
+        return self.request("PUT", path, json=json, **kwargs)
+
+    def post(self, path, json=None, **kwargs):
+        return self.request("POST", path, json=json, **kwargs)
+
+    def patch(self, path, json=None, **kwargs):
+        return self.request("PATCH", path, json=json, **kwargs)
+
+
+# Shared by every GitHub call; the pool leaves room for the download workers.
+github = GitHubClient(GITHUB_API_URL, pool_size=max(FETCH_CONCURRENCY, 10))
+
+
+def git_blob_sha(content):
+    """Return the git blob SHA-1 of some bytes, as GitHub reports it."""
+    return hashlib.sha1(b"blob %d\0" % len(content) + content).hexdigest()
+
+
+class BlobCache:
+    """Disk-backed, size-bounded LRU cache of git blobs keyed by blob SHA.
+
+    Committed submissions never change, so a blob SHA identifies its
+    content forever and cached entries never need revalidating. Entries
+    are stored git-style as ``<dir>/<sha[:2]>/<sha[2:]>``; file mtimes
+    record recency so a new instance on the same disk picks up the LRU
+    order. The cache is best-effort: disk errors are logged and treated
+    as misses.
+    """
+
+    # Small files still occupy a whole filesystem block, so charge at
+    # least this much per entry against the size budget.
+    BLOCK_SIZE = 4096
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._index = None  # sha -> charged size, least recently used first
+        self._total = 0
+        self._lock = threading.Lock()
+
+    def _path(self, sha):
+        return os.path.join(self.directory, sha[:2], sha[2:])
+
+    def _charge(self, size):
+        return max(size, self.BLOCK_SIZE)
+
+    def _load_index(self):
+        entries = []
+        try:
+            for bucket in os.scandir(self.directory):
+                if not bucket.is_dir():
+                    continue
+                for entry in os.scandir(bucket.path):
+                    if '.tmp' in entry.name:
+                        continue
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, bucket.name + entry.name, stat.st_size))
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            print(f"Error scanning blob cache: {e}")
+        entries.sort()
+        self._index = OrderedDict()
+        self._total = 0
+        for _, sha, size in entries:
+            self._index[sha] = self._charge(size)
+            self._total += self._index[sha]
+        self._evict()
+
+    def _evict(self):
+        while self._total > self.max_bytes and self._index:
+            sha, charged = self._index.popitem(last=False)
+            self._total -= charged
+            try:
+                os.remove(self._path(sha))
+            except OSError:
+                pass
+
+    def get(self, sha):
+        """Return the cached content for a blob SHA, or None on a miss."""
+        with self._lock:
+            if self._index is None:
+                self._load_index()
+            if sha not in self._index:
+                return None
+            self._index.move_to_end(sha)
+        path = self._path(sha)
+        try:
+            with open(path, 'rb') as f:
+                content = f.read()
+            os.utime(path)
+            return content
+        except OSError:
+            with self._lock:
+                self._total -= self._index.pop(sha, 0)
+            return None
+
+    def put(self, sha, content):
+        """Store a blob, ignoring content that does not match its SHA."""
+        if git_blob_sha(content) != sha:
+            print(f"Refusing to cache blob {sha}: content does not match SHA")
+            return
+        path = self._path(sha)
+        tmp_path = f"{path}.tmp-{os.getpid()}-{threading.get_ident()}"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp_path, 'wb') as f:
+                f.write(content)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Error writing blob cache entry {sha}: {e}")
+            return
+        with self._lock:
+            if self._index is None:
+                self._load_index()
+            self._total -= self._index.pop(sha, 0)
+            self._index[sha] = self._charge(len(content))
+            self._total += self._index[sha]
+            self._evict()
+
+
+# Local cache of submission blobs; /tmp is the only writable disk on Vercel.
+blob_cache = BlobCache(
+    os.getenv("BLOB_CACHE_DIR", os.path.join(tempfile.gettempdir(), "watch-index-blobs")),
+    int(os.getenv("BLOB_CACHE_MAX_BYTES", str(128 * 1024 * 1024))),
+)
+
+
+def _tree_csv_entries(tree, prefix):
+    """Pick the submissions/*.csv blobs out of a Git Trees API listing."""
+    entries = []
+    for item in tree:
+        path = prefix + item['path']
+        directory, _, name = path.rpartition('/')
+        if item['type'] == 'blob' and directory == 'submissions' and name.endswith('.csv'):
+            entries.append({'path': path, 'name': name, 'sha': item['sha'], 'size': item.get('size', 0)})
+    return entries
+
+
+class TruncatedListing(Exception):
+    """Raised when GitHub truncates the submissions tree listing."""
+
+
+def list_submission_files():
+    """List every CSV in the submissions directory via the Git Trees API.
+
+    A single recursive tree request covers the whole repository, so unlike
+    the contents API there is no 1,000-entry ceiling. If GitHub truncates
+    the recursive listing (very large trees), the ``submissions`` subtree
+    is listed on its own instead.
+
     Returns:
-        List of tuples: (filename, content)
+        List of dicts with 'path', 'name', 'sha' (git blob SHA) and 'size',
+        sorted by path.
+
+    Raises:
+        requests.HTTPError: If a tree could not be fetched.
+        TruncatedListing: If even the ``submissions`` subtree is too large
+            to be listed in full (GitHub stops at 100,000 entries or 7 MB);
+            the archive has to be read from the tarball instead.
     """
-    token = os.getenv("GITHUB_TOKEN")
-    repo_full_name = os.getenv("REPO_FULL_NAME")
-    if not token or not repo_full_name:
+    if not github.configured:
         print("GITHUB_TOKEN or REPO_FULL_NAME environment variable not set.")
         return []
-    
-    try:
-        url = f"https://api.github.com/repos/{repo_full_name}/contents/submissions"
-        headers = {
-            "Authorization": f"token {token}",
-            "Accept": "application/vnd.github+json",
-        }
-        
-        response = requests.get(url, headers=headers)
-        if response.status_code != 200:
-            print(f"Failed to fetch submissions directory: {response.status_code}")
+
+    response = github.get("/git/trees/main", params={"recursive": "1"})
+    response.raise_for_status()
+    listing = response.json()
+    if not listing.get('truncated'):
+        entries = _tree_csv_entries(listing['tree'], '')
+    else:
+        # A truncated listing may stop before "submissions"; the top level
+        # on its own always fits
+        response = github.get("/git/trees/main")
+        response.raise_for_status()
+        subtree_sha = next(
+            (item['sha'] for item in response.json()['tree']
+             if item['path'] == 'submissions' and item['type'] == 'tree'),
+            None,
+        )
+        if subtree_sha is None:
             return []
-        
-        files = response.json()
-        csv_files = []
-        
-        for file_info in files:
-            if file_info['name'].endswith('.csv'):
-                # Fetch the file content
-                file_response = requests.get(file_info['download_url'])
-                if file_response.status_code == 200:
-                    csv_files.append((file_info['name'], file_response.text))
-        
-        return csv_files
-    except Exception as e:
-        print(f"Error fetching CSV files: {e}")
-        return []
+        response = github.get(f"/git/trees/{subtree_sha}")
+        response.raise_for_status()
+        listing = response.json()
+        if listing.get('truncated'):
+            raise TruncatedListing(f"submissions tree {subtree_sha} is too large to list")
+        entries = _tree_csv_entries(listing['tree'], 'submissions/')
+    entries.sort(key=lambda entry: entry['path'])
+    return entries
 
 
-def aggregate_submissions(csv_files):
-    """Aggregate CSV submissions and calculate metrics.
-    
-    Args:
-        csv_files: List of tuples (filename, content)
-    
+def _download_csv_file(file_info):
+    """Return one submission blob, from the blob cache or by downloading it.
+
     Returns:
-        Dictionary with aggregated data
+        Tuple (filename, content).
+
+    Raises:
+        requests.RequestException: If the blob could not be downloaded.
     """
-    submissions = []
-    
-    for filename, content in csv_files:
-        try:
-            reader = csv.DictReader(StringIO(content))
-            for row in reader:
-                submissions.append(row)
-        except Exception as e:
-            print(f"Error parsing {filename}: {e}")
-            continue
-    
-    if not submissions:
-        return {
-            "totals": {"submissions": 0},
-            "averages": {"sleepHours": 0, "restViolations": 0},
-            "byShip": {},
-            "byRegion": {},
-            "updatedAt": datetime.utcnow().isoformat() + "+00:00"
-        }
-    
-    # Calculate metrics
-    total_submissions = len(submissions)
-    total_sleep = sum(float(s.get('sleep_hours', 0)) for s in submissions)
-    total_violations = sum(float(s.get('rest_violations', 0)) for s in submissions)
-    
-    avg_sleep = total_sleep / total_submissions if total_submissions > 0 else 0
-    avg_violations = total_violations / total_submissions if total_submissions > 0 else 0
-    
-    # Group by ship type
-    by_ship = defaultdict(int)
-    for s in submissions:
-        ship_type = s.get('ship_type', 'Unknown')
-        by_ship[ship_type] += 1
-    
-    # Group by region
-    by_region = defaultdict(int)
-    for s in submissions:
-        region = s.get('region', 'Unknown')
-        by_region[region] += 1
-    
-    return {
-        "totals": {"submissions": total_submissions},
-        "averages": {
-            "sleepHours": round(avg_sleep, 2),
-            "restViolations": round(avg_violations, 2)
-        },
-        "byShip": dict(by_ship),
-        "byRegion": dict(by_region),
-        "updatedAt": datetime.utcnow().isoformat() + "+00:00"
-    }
+    content = blob_cache.get(file_info['sha'])
+    if content is None:
+        response = github.get(
+            f"/git/blobs/{file_info['sha']}",
+            headers={"Accept": "application/vnd.github.raw"},
+            conditional=False,
+        )
+        response.raise_for_status()
+        content = response.content
+        blob_cache.put(file_info['sha'], content)
+    return (file_info['name'], content.decode('utf-8', errors='replace'))
+
+
+def _bounded_map(fn, items, workers):
+    """Lazily map fn over items on a thread pool, yielding results in order.
+
+    Unlike ``Executor.map`` only ``2 * workers`` calls are in flight at
+    once, so results are produced as fast as they are consumed instead of
+    piling up in memory.
+    """
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for item in items:
+            pending.append(executor.submit(fn, item))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
 
+def iter_csv_files_from_github(files=None):
+    """Lazily fetch every CSV file in the submissions directory on GitHub.
 
-def commit_to_github(filename: str, content: bytes, message: str = "Add submission") -> bool:
-    """Commit a file to the configured GitHub repository.
+    The directory is listed with list_submission_files() and each blob not
+    already in the local blob cache is downloaded by SHA, up to
+    FETCH_CONCURRENCY at a time and only a little ahead of the consumer.
 
     Args:
-        filename: The filename (path relative to the repo root) to commit.
-        content: Raw byte content of the file.
-        message: Commit message.
+        files: Optional list_submission_files() entries to fetch instead
+            of listing the whole directory.
+
+    Yields:
+        Tuples (filename, content) in path order.
+
+    Raises:
+        requests.RequestException: If the listing or any download failed,
+            so a partial fetch never publishes an undercounted aggregate.
+    """
+    if not github.configured:
+        print("GITHUB_TOKEN or REPO_FULL_NAME environment variable not set.")
+        return
+
+    if files is None:
+        files = list_submission_files()
+    yield from _bounded_map(_download_csv_file, files, FETCH_CONCURRENCY)
+
+
+def get_csv_files_from_github():
+    """Fetch all CSV files from the submissions directory on GitHub.
+
+    Materializes iter_csv_files_from_github(); aggregation consumes the
+    generator directly instead.
 
     Returns:
-        True if the commit succeeded, False otherwise.
+        List of tuples: (filename, content)
+    """
+    return list(iter_csv_files_from_github())
+
+
+def iter_csv_files_from_archive():
+    """Stream submission CSVs out of the repository tarball.
+
+    Downloads the tarball of the main branch in one request and walks it
+    with ``tarfile`` in streaming mode, so members are read one at a time
+    straight off the socket without touching disk or buffering the archive.
+
+    Yields:
+        Tuples (filename, content) for every ``submissions/*.csv`` member.
+
+    Raises:
+        requests.HTTPError: If the tarball could not be downloaded, so a
+            failed fetch never publishes an empty aggregate.
     """
-    token = os.getenv("GITHUB_TOKEN")
-    repo_full_name = os.getenv("REPO_FULL_NAME")
-    if not token or not repo_full_name:
+    if not github.configured:
         print("GITHUB_TOKEN or REPO_FULL_NAME environment variable not set.")
-        return False
+        return
 
-    url = f"https://api.github.com/repos/{repo_full_name}/contents/{filename}"
-    encoded_content = base64.b64encode(content).decode('utf-8')
-    headers = {
-        "Authorization": f"token {token}",
-        "Accept": "application/vnd.github+json",
-    }
-    
-    # Check if file exists and get its SHA
-    sha = None
-    get_response = requests.get(url, headers=headers)
-    if get_response.status_code == 200:
-        sha = get_response.json().get('sha')
-    
-    data = {
-        "message": message,
-        "content": encoded_content,
-        "branch": "main",
-    }
-    
-    # Include SHA if file exists (for updates)
-    if sha:
-        data["sha"] = sha
-    
-    response = requests.put(url, json=data, headers=headers)
-    if response.status_code in (201, 200):
-        return True
-    else:
-        print(f"GitHub API returned {response.status_code}: {response.text}")
-        return False
+    with github.get("/tarball/main", stream=True, timeout=(10, 60)) as response:
+        response.raise_for_status()
+        response.raw.decode_content = True
+        with tarfile.open(fileobj=response.raw, mode='r|*') as archive:
+            for member in archive:
+                if not member.isfile():
+                    continue
+                # Members are prefixed with a single "<owner>-<repo>-<sha>/" directory
+                _, _, path = member.name.partition('/')
+                directory, _, name = path.rpartition('/')
+                if directory != 'submissions' or not name.endswith('.csv'):
+                    continue
+                content = archive.extractfile(member).read()
+                yield (name, content.decode('utf-8', errors='replace'))
 
 
-def update_aggregated_data():
-    """Fetch all CSV files, aggregate them, and commit the updated data.json."""
-    try:
-        # Fetch all CSV files from GitHub
-        csv_files = get_csv_files_from_github()
-        print(f"Found {len(csv_files)} CSV files")
-        
-        # Aggregate the data
-        aggregated_data = aggregate_submissions(csv_files)
-        print(f"Aggregated {aggregated_data['totals']['submissions']} submissions")
-        
-        # Commit the updated data.json
-        data_json = json.dumps(aggregated_data, indent=2)
-        success = commit_to_github(
-            'data/data.json',
-            data_json.encode('utf-8'),
-            f"Update aggregated data - {aggregated_data['totals']['submissions']} submissions"
-        )
-        
-        return success
-    except Exception as e:
-        print(f"Error updating aggregated data: {e}")
-        return False
+class _ExactSum:
+    """Exact running sum of floats that can be merged in any order.
 
+    Keeps the total as non-overlapping partials (the algorithm behind
+    ``math.fsum``), so folding rows in one at a time, rebuilding from the
+    archive, or merging two partial totals all round to the same float.
+    The partials only depend on the exact total, not on how it was split
+    into batches, so merged states also serialize identically.
+    """
 
-@app.route('/upload', methods=['POST'])
-def upload_file():
-    """Endpoint to handle file submissions and commit them to GitHub.
+    __slots__ = ('partials',)
 
-    Expects a multipart/form-data POST request with a file field named
-    "submission" containing a CSV file. The file will be stored in the
-    `submissions/` directory of the configured repository.
-    
-    Security features:
-    - Rate limiting: 1 submission per IP per 24 hours
-    - Data validation: Checks for reasonable values
-    - Honeypot detection: Rejects submissions with honeypot field filled
+    def __init__(self, partials=()):
+        self.partials = list(partials)
+
+    def extend(self, values):
+        """Add a whole column of finite floats at C speed.
+
+        Repeated ``math.fsum`` passes peel the exact total of the column
+        and the current partials into a few floats: each pass adds the
+        correctly rounded remainder as a new partial, until the remainder
+        is exactly zero.
+        """
+        previous = self.partials
+        partials = []
+        while True:
+            remainder = math.fsum(itertools.chain(values, previous, (-p for p in partials)))
+            if not remainder:
+                break
+            partials.append(remainder)
+        partials.reverse()
+        self.partials = partials
+
+    def merge(self, other):
+        self.extend(other.partials)
+
+    @property
+    def value(self):
+        return math.fsum(self.partials)
+
+
+class QuantileSketch:
+    """Mergeable quantile sketch for a bounded numeric field.
+
+    Values are counted in fixed-width bins centred on ``low``, ``low +
+    step``, ... ``high``; anything outside the range is clamped into the
+    end bins. Both published fields are bounded by validation (sleep
+    hours 0-24, rest violations 0-50), so a fixed grid of counters is
+    enough: memory is constant in the number of values, updates are O(1),
+    and merging two sketches is adding their counters, which is exact,
+    associative and independent of order (unlike t-digest or KLL, whose
+    results depend on insertion and merge order).
+
+    Error bounds, for values inside [low, high]:
+
+    * Rank error is zero: ``quantile(q)`` returns the bin holding the
+      nearest-rank sample, i.e. the ceil(q * n)-th smallest value.
+    * Value error is at most ``step / 2`` from that sample, and zero for
+      values that are multiples of ``step`` (e.g. one decimal place with
+      step 0.1, which covers what the submission form produces).
+
+    Out-of-range values (possible only in hand-edited archive files) are
+    reported as ``low`` or ``high``.
     """
-    # Get client IP address (handle proxies)
-    if request.headers.get('X-Forwarded-For'):
-        ip_address = request.headers.get('X-Forwarded-For').split(',')[0].strip()
-    else:
-        ip_address = request.remote_addr
-    
-    # Check rate limit
-    allowed, wait_time = check_rate_limit(ip_address)
-    if not allowed:
-        hours_remaining = wait_time // 3600
-        minutes_remaining = (wait_time % 3600) // 60
-        return jsonify({
-            'error': f'Rate limit exceeded. Please wait {hours_remaining}h {minutes_remaining}m before submitting again.'
-        }), 429
-    
-    # Check for honeypot field (bot detection)
-    honeypot_value = request.form.get('website', '')
-    if honeypot_value:
-        # This is likely a bot - honeypot field should be empty
-        print(f"Honeypot triggered from IP: {ip_address}")
-        return jsonify({'error': 'Invalid submission.'}), 400
-    
-    if 'submission' not in request.files:
-        return jsonify({'error': 'No submission file provided.'}), 400
-    
-    file = request.files['submission']
-    if file.filename == '':
-        return jsonify({'error': 'Empty filename.'}), 400
-    
-    try:
-        content = file.read()
-        
-        # Parse and validate the CSV data
-        try:
-            csv_content = content.decode('utf-8')
-            reader = csv.DictReader(StringIO(csv_content))
-            rows = list(reader)
-            
-            if not rows:
-                return jsonify({'error': 'Empty CSV file.'}), 400
-            
-            # Validate the first (and should be only) row
-            valid, error_msg = validate_submission_data(rows[0])
-            if not valid:
-                return jsonify({'error': error_msg}), 400
-                
-        except Exception as e:
-            return jsonify({'error': f'Invalid CSV format: {str(e)}'}), 400
-        
-        # Proceed with committing the file
-        timestamp = datetime.utcnow().strftime('%Y%m%d_%H%M%S')
-        safe_filename = file.filename.replace("..", "_")
-        target_path = f"submissions/{timestamp}_{safe_filename}"
-        commit_message = f"Add submission {safe_filename} on {timestamp}"
-        success = commit_to_github(target_path, content, commit_message)
-        
-        if success:
-            # Update the aggregated data
-            update_aggregated_data()
-            return jsonify({'status': 'success'}), 200
+
+    def __init__(self, low, high, step):
+        self.low = low
+        self.high = high
+        self.step = step
+        self.size = int(round((high - low) / step)) + 1
+        self.counts = array('Q', bytes(8 * self.size))
+        self.count = 0
+
+    def _bin(self, value):
+        return min(max(round((value - self.low) / self.step), 0), self.size - 1)
+
+    def add(self, value):
+        self.counts[self._bin(value)] += 1
+        self.count += 1
+
+    def extend(self, values):
+        """Add a column of values (e.g. an ``array('d')``)."""
+        if not len(values):
+            return
+        if np is not None:
+            bins = np.clip(np.rint((np.frombuffer(values, dtype='d') - self.low) / self.step), 0, self.size - 1)
+            for i, count in enumerate(np.bincount(bins.astype(np.intp), minlength=self.size).tolist()):
+                self.counts[i] += count
         else:
-            return jsonify({'error': 'Failed to commit file to GitHub.'}), 500
-            
-    except Exception as e:
-        print(f"Exception while processing upload: {e}")
-        return jsonify({'error': 'Internal server error.'}), 500
+            for i, count in Counter(map(self._bin, values)).items():
+                self.counts[i] += count
+        self.count += len(values)
+
+    def merge(self, other):
+        for i, count in enumerate(other.counts):
+            self.counts[i] += count
+        self.count += other.count
+
+    def dump(self):
+        """Return the non-empty bins as [[bin, count], ...] for a snapshot."""
+        return [[i, count] for i, count in enumerate(self.counts) if count]
+
+    def load(self, bins):
+        for i, count in bins:
+            self.counts[i] += count
+            self.count += count
+        return self
+
+    def quantile(self, q):
+        """Return the nearest-rank q-quantile (0 < q <= 1), or 0 when empty."""
+        if not self.count:
+            return 0
+        rank = max(1, math.ceil(q * self.count))
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return self.low + i * self.step
+        return self.high
+
+
+# Columns of the submission CSV schema.
+SUBMISSION_FIELDS = ('sleep_hours', 'rest_violations', 'ship_type', 'region',
+                     'called_during_rest', 'port_intensity')
+
+
+# Projections of headers seen so far; nearly every file has the same one.
+_projections = {}
+
+
+def _submission_reader(lines):
+    """Open a csv.reader over an iterator of lines and resolve the schema columns.
+
+    Returns:
+        Tuple (reader positioned after the header, the header as a tuple
+        or None if there are no lines, an itemgetter projecting a row onto
+        SUBMISSION_FIELDS). The getter is None if the header lacks any of
+        the fields, in which case callers fall back to csv.DictReader.
+    """
+    reader = csv.reader(lines)
+    header = next(reader, None)
+    if header is None:
+        return reader, None, None
+    header = tuple(header)
+    project = _projections.get(header)
+    if project is None:
+        # Like DictReader, the last of any repeated column name wins
+        index = {name: i for i, name in enumerate(header)}
+        if not all(field in index for field in SUBMISSION_FIELDS):
+            return reader, header, None
+        project = itemgetter(*(index[field] for field in SUBMISSION_FIELDS))
+        if len(_projections) < 64:
+            _projections[header] = project
+    return reader, header, project
+
+
+def iter_submission_rows(lines):
+    """Lazily parse submission CSV lines into row dicts of the schema fields.
+
+    Equivalent to ``csv.DictReader(lines)`` restricted to
+    SUBMISSION_FIELDS, but builds each dict from a projected tuple
+    instead of zipping the whole header. Files whose header lacks a
+    field go through DictReader unchanged.
+
+    Args:
+        lines: Iterable of lines, as iterating a text file yields them.
+
+    Yields:
+        Dicts; fields missing from a short row are None.
+    """
+    lines = iter(lines)
+    reader, header, project = _submission_reader(lines)
+    if header is None:
+        return
+    if project is None:
+        # The header line has been consumed; DictReader maps the rest by it
+        yield from csv.DictReader(lines, fieldnames=list(header))
+        return
+    width = len(header)
+    for row in reader:
+        if not row:
+            continue
+        if len(row) < width:
+            row += [None] * (width - len(row))
+        yield dict(zip(SUBMISSION_FIELDS, project(row)))
+
+
+def read_submission_rows(text):
+    """Parse submission CSV text into a list of row dicts; see iter_submission_rows()."""
+    return list(iter_submission_rows(StringIO(text)))
+
+
+def _count_codes(codes, size):
+    """Count occurrences of each code in an ``array`` of small ints."""
+    if np is not None and codes:
+        return np.bincount(np.frombuffer(codes, dtype=codes.typecode), minlength=size).tolist()
+    counts = [0] * size
+    for code, count in Counter(codes).items():
+        counts[code] = count
+    return counts
+
+
+class _CategoricalColumn:
+    """A column of ``array('I')`` codes into labels kept in first-seen order."""
+
+    def __init__(self):
+        self.codes = array('I')
+        self.labels = []
+        self._index = {}
+
+    def append(self, value):
+        code = self._index.get(value)
+        if code is None:
+            code = self._index[value] = len(self.labels)
+            self.labels.append(value)
+        self.codes.append(code)
+
+    def counts(self):
+        """Return {label: count} in first-seen order."""
+        counts = _count_codes(self.codes, len(self.labels))
+        return {label: count for label, count in zip(self.labels, counts) if count}
+
+
+class SubmissionColumns:
+    """A batch of submission rows parsed straight into typed columns.
+
+    Numeric fields are stored in ``array('d')`` and categorical fields as
+    ``array('I')`` codes into label lists kept in first-seen order, so a
+    row costs a few dozen bytes instead of a dict, and sums and group-by
+    counts run over whole columns at once.
+    """
+
+    def __init__(self):
+        self.sleep_hours = array('d')
+        self.rest_violations = array('d')
+        # Day (proleptic Gregorian ordinal) of each row's submission, 0 if unknown
+        self.days = array('i')
+        self.ship_type = _CategoricalColumn()
+        self.region = _CategoricalColumn()
+        self.port_intensity = _CategoricalColumn()
+        self.called_during_rest = _CategoricalColumn()
+
+    def __len__(self):
+        return len(self.sleep_hours)
+
+    def _columns(self):
+        return (self.sleep_hours, self.rest_violations, self.days, self.ship_type.codes,
+                self.region.codes, self.port_intensity.codes, self.called_during_rest.codes)
+
+    def append_row(self, row, day=0):
+        """Append one CSV row (dict), raising ValueError/TypeError if it is unusable.
+
+        Args:
+            row: The CSV row.
+            day: Ordinal of the day the row was submitted, 0 if unknown.
+        """
+        sleep = float(row.get('sleep_hours', 0))
+        violations = float(row.get('rest_violations', 0))
+        if not (math.isfinite(sleep) and math.isfinite(violations)):
+            raise ValueError("non-finite numeric value")
+        self.sleep_hours.append(sleep)
+        self.rest_violations.append(violations)
+        self.days.append(day)
+        self.ship_type.append(row.get('ship_type', 'Unknown'))
+        self.region.append(row.get('region', 'Unknown'))
+        self.port_intensity.append(row.get('port_intensity', 'Unknown'))
+        self.called_during_rest.append(row.get('called_during_rest', 'Unknown'))
+
+    def append_csv(self, filename, content):
+        """Append every row of one CSV file.
+
+        A file that fails to parse is rolled back as a whole and logged.
+
+        Returns:
+            True if the file was appended, False if it was skipped.
+        """
+        mark = len(self)
+        day = submission_day(filename)
+        try:
+            reader, header, project = _submission_reader(StringIO(content))
+            if project is not None:
+                self._append_projected(reader, len(header), project, day)
+            else:
+                for row in csv.DictReader(StringIO(content)):
+                    self.append_row(row, day)
+        except Exception as e:
+            print(f"Error parsing {filename}: {e}")
+            for column in self._columns():
+                del column[mark:]
+            return False
+        return True
+
+    def _append_projected(self, reader, width, project, day):
+        """Append csv.reader rows via a SUBMISSION_FIELDS projection.
+
+        The per-row work of append_row() without building a dict: blank
+        rows are skipped and short rows padded with None, as DictReader
+        would.
+        """
+        isfinite = math.isfinite
+        sleep_hours, rest_violations, days = self.sleep_hours, self.rest_violations, self.days
+        ship_type, region = self.ship_type.append, self.region.append
+        called_during_rest, port_intensity = self.called_during_rest.append, self.port_intensity.append
+        for row in reader:
+            if not row:
+                continue
+            if len(row) < width:
+                row += [None] * (width - len(row))
+            sleep, violations, ship, reg, called, intensity = project(row)
+            sleep = float(sleep)
+            violations = float(violations)
+            if not (isfinite(sleep) and isfinite(violations)):
+                raise ValueError("non-finite numeric value")
+            sleep_hours.append(sleep)
+            rest_violations.append(violations)
+            days.append(day)
+            ship_type(ship)
+            region(reg)
+            port_intensity(intensity)
+            called_during_rest(called)
+
+    def group_by(self, keys):
+        """Split the numeric columns by a per-row key.
+
+        Args:
+            keys: Iterable of one hashable key per row.
+
+        Returns:
+            Dict mapping each key to a pair of ``array('d')`` columns
+            (sleep hours, rest violations), in first-seen order.
+        """
+        groups = {}
+        for key, sleep, violations in zip(keys, self.sleep_hours, self.rest_violations):
+            group = groups.get(key)
+            if group is None:
+                group = groups[key] = (array('d'), array('d'))
+            group[0].append(sleep)
+            group[1].append(violations)
+        return groups
+
+    def cells(self):
+        """Group the rows by cube cell.
+
+        Returns:
+            Dict mapping (ship_type, region, port_intensity,
+            called_during_rest) to a pair of ``array('d')`` columns
+            (sleep hours, rest violations), in first-seen order.
+        """
+        groups = self.group_by(zip(self.ship_type.codes, self.region.codes,
+                                   self.port_intensity.codes, self.called_during_rest.codes))
+        labels = (self.ship_type.labels, self.region.labels,
+                  self.port_intensity.labels, self.called_during_rest.labels)
+        return {
+            tuple(dimension[code] for dimension, code in zip(labels, key)): group
+            for key, group in groups.items()
+        }
+
+
+class CellStats:
+    """Count, sums and sums of squares of both numeric fields for a group of rows."""
+
+    __slots__ = ('count', 'sleep_sum', 'sleep_sumsq', 'violation_sum', 'violation_sumsq')
+
+    def __init__(self):
+        self.count = 0
+        self.sleep_sum = _ExactSum()
+        self.sleep_sumsq = _ExactSum()
+        self.violation_sum = _ExactSum()
+        self.violation_sumsq = _ExactSum()
+
+    def add_columns(self, sleep_hours, rest_violations):
+        self.count += len(sleep_hours)
+        self.sleep_sum.extend(sleep_hours)
+        self.sleep_sumsq.extend(array('d', (x * x for x in sleep_hours)))
+        self.violation_sum.extend(rest_violations)
+        self.violation_sumsq.extend(array('d', (x * x for x in rest_violations)))
+
+    def merge(self, other):
+        self.count += other.count
+        self.sleep_sum.merge(other.sleep_sum)
+        self.sleep_sumsq.merge(other.sleep_sumsq)
+        self.violation_sum.merge(other.violation_sum)
+        self.violation_sumsq.merge(other.violation_sumsq)
+        return self
+
+    def to_data(self):
+        return [self.count,
+                round(self.sleep_sum.value, 4), round(self.sleep_sumsq.value, 4),
+                round(self.violation_sum.value, 4), round(self.violation_sumsq.value, 4)]
+
+    def dump(self):
+        """Return [count, partials x 4] for a snapshot."""
+        return [self.count, self.sleep_sum.partials, self.sleep_sumsq.partials,
+                self.violation_sum.partials, self.violation_sumsq.partials]
+
+    @classmethod
+    def load(cls, data):
+        cell = cls()
+        cell.count = data[0]
+        cell.sleep_sum = _ExactSum(data[1])
+        cell.sleep_sumsq = _ExactSum(data[2])
+        cell.violation_sum = _ExactSum(data[3])
+        cell.violation_sumsq = _ExactSum(data[4])
+        return cell
+
+
+class AggregateCube:
+    """Precomputed ship type x region x port intensity x called-during-rest cube.
+
+    Every occupied cell keeps a CellStats, so the count, mean and variance
+    of either numeric field for any slice can be read off in O(cells)
+    without rescanning rows. rollup() collapses the cube onto any subset
+    of the dimensions.
+    """
+
+    DIMENSIONS = ('ship_type', 'region', 'port_intensity', 'called_during_rest')
+
+    def __init__(self):
+        self.cells = {}
+
+    def add_columns(self, columns):
+        for key, (sleep_hours, rest_violations) in columns.cells().items():
+            cell = self.cells.get(key)
+            if cell is None:
+                cell = self.cells[key] = CellStats()
+            cell.add_columns(sleep_hours, rest_violations)
+
+    def merge(self, other):
+        for key, other_cell in other.cells.items():
+            cell = self.cells.get(key)
+            if cell is None:
+                cell = self.cells[key] = CellStats()
+            cell.merge(other_cell)
+        return self
+
+    def rollup(self, dimensions):
+        """Collapse the cube onto a subset of DIMENSIONS.
+
+        Args:
+            dimensions: Names from DIMENSIONS to keep, in the order wanted.
+
+        Returns:
+            Dict mapping tuples of labels (one per kept dimension) to
+            merged CellStatss. An empty subset gives the grand total
+            under the key ``()``.
+        """
+        positions = [self.DIMENSIONS.index(dimension) for dimension in dimensions]
+        rolled = {}
+        for key, cell in self.cells.items():
+            projected = tuple(key[position] for position in positions)
+            target = rolled.get(projected)
+            if target is None:
+                target = rolled[projected] = CellStats()
+            target.merge(cell)
+        return rolled
+
+    def dump(self):
+        return [list(key) + cell.dump() for key, cell in self.cells.items()]
+
+    def load(self, cells):
+        dimensions = len(self.DIMENSIONS)
+        for item in cells:
+            self.cells[tuple(item[:dimensions])] = CellStats.load(item[dimensions:])
+        return self
+
+    def to_data(self):
+        """Render the cube for data.json as a list of cells sorted by key."""
+        cells = sorted(self.cells.items(), key=lambda item: tuple(str(label) for label in item[0]))
+        return {
+            "dimensions": ["shipType", "region", "portIntensity", "calledDuringRest"],
+            "measures": ["count", "sleepHoursSum", "sleepHoursSumSq",
+                         "restViolationsSum", "restViolationsSumSq"],
+            "cells": [list(key) + cell.to_data() for key, cell in cells],
+        }
+
+
+class TimeBuckets:
+    """Daily or weekly aggregates keyed by submission date.
+
+    Each bucket is a CellStats for one period (a UTC day, or an ISO week
+    starting on Monday), keyed by the ordinal of the period's first day.
+    Uploads are stamped with the time they are committed, so in practice
+    only the current period ever receives rows. A bucket is sealed once
+    it is older than the previous period, and rows folded in with a
+    ``today`` are refused by sealed buckets, so from then on a bucket is
+    immutable and can be cached indefinitely. The previous period stays
+    open to absorb clock skew between instances around midnight.
+    """
+
+    def __init__(self, period_days):
+        self.period_days = period_days
+        self.buckets = {}
+
+    def period_start(self, day):
+        """Return the ordinal of the first day of the period containing day."""
+        if self.period_days == 7:
+            # Ordinal 1 (0001-01-01) is a Monday
+            return day - (day - 1) % 7
+        return day
+
+    def add_columns(self, columns, today=None):
+        """Fold a SubmissionColumns batch into its buckets, skipping undated rows.
+
+        Args:
+            columns: The batch.
+            today: Day ordinal as of which sealed buckets refuse rows, or
+                None to fill every bucket (a rebuild from the archive).
+        """
+        groups = columns.group_by(self.period_start(day) if day else 0 for day in columns.days)
+        groups.pop(0, None)
+        for start, (sleep_hours, rest_violations) in groups.items():
+            if today is not None and self.is_sealed(start, today):
+                continue
+            bucket = self.buckets.get(start)
+            if bucket is None:
+                bucket = self.buckets[start] = CellStats()
+            bucket.add_columns(sleep_hours, rest_violations)
+
+    def merge(self, other, today=None):
+        """Merge another TimeBuckets in; today works as in add_columns()."""
+        for start, other_bucket in other.buckets.items():
+            if today is not None and self.is_sealed(start, today):
+                continue
+            bucket = self.buckets.get(start)
+            if bucket is None:
+                bucket = self.buckets[start] = CellStats()
+            bucket.merge(other_bucket)
+        return self
+
+    def dump(self):
+        return [[start] + bucket.dump() for start, bucket in self.buckets.items()]
+
+    def load(self, buckets):
+        for item in buckets:
+            self.buckets[item[0]] = CellStats.load(item[1:])
+        return self
+
+    def is_sealed(self, start, today):
+        """Whether the bucket starting at start is sealed as of day today."""
+        return start < self.period_start(today) - self.period_days
+
+    def to_data(self, today, limit=None):
+        """Render the buckets oldest first, optionally only the newest limit."""
+        starts = sorted(self.buckets)
+        if limit is not None:
+            starts = starts[-limit:]
+        trend = []
+        for start in starts:
+            bucket = self.buckets[start]
+            trend.append({
+                "start": date.fromordinal(start).isoformat(),
+                "count": bucket.count,
+                "sleepHours": round(bucket.sleep_sum.value / bucket.count, 2),
+                "restViolations": round(bucket.violation_sum.value / bucket.count, 2),
+                "sealed": self.is_sealed(start, today),
+            })
+        return trend
+
+
+_SUBMISSION_TIMESTAMP = re.compile(r'^(\d{8})_\d{6}_')
+
+
+def submission_day(filename):
+    """Return the day ordinal encoded in a submission filename, or 0.
+
+    ``upload_file`` names submissions ``<%Y%m%d_%H%M%S>_<original name>``;
+    a directory prefix is ignored.
+    """
+    match = _SUBMISSION_TIMESTAMP.match(filename.rpartition('/')[2])
+    if not match:
+        return 0
+    try:
+        return datetime.strptime(match.group(1), '%Y%m%d').toordinal()
+    except ValueError:
+        return 0
+
+
+def _percentiles(sketch):
+    """Return the published p10 / median / p90 of a QuantileSketch."""
+    return {
+        "p10": round(sketch.quantile(0.1), 2),
+        "p50": round(sketch.quantile(0.5), 2),
+        "p90": round(sketch.quantile(0.9), 2),
+    }
+
+
+class AggregateState:
+    """Mergeable aggregate behind ``data/data.json``.
+
+    Holds counts, exact sums, quantile sketches, per-ship / per-region
+    tallies, the four-dimensional cube and daily / weekly time buckets
+    instead of the published figures themselves, so new rows can be
+    folded in and partial states merged without revisiting the archive.
+
+    ``files`` counts the submission files folded in (including ones that
+    failed to parse) and ``cursor`` is the greatest of their names.
+    Submission names start with their timestamp, so files sorting after
+    the cursor are the ones a snapshot has not seen yet.
+    """
+
+    # Rows buffered in columns before they are folded into the totals.
+    BATCH_ROWS = 64 * 1024
+
+    # Daily buckets published in data.json; older ones stay in the state.
+    PUBLISHED_DAYS = 90
+
+    # Bumped whenever the snapshot layout changes; other versions are ignored.
+    SNAPSHOT_VERSION = 1
+
+    def __init__(self):
+        self.files = 0
+        self.cursor = ''
+        self.submissions = 0
+        self.sleep_hours = _ExactSum()
+        self.rest_violations = _ExactSum()
+        self.by_ship = {}
+        self.by_region = {}
+        self.sleep_quantiles = QuantileSketch(0, 24, 0.1)
+        self.violation_quantiles = QuantileSketch(0, 50, 0.1)
+        self.cube = AggregateCube()
+        self.daily = TimeBuckets(1)
+        self.weekly = TimeBuckets(7)
+
+    @classmethod
+    def from_csv_files(cls, csv_files):
+        """Build a state from an iterable of (filename, content) tuples.
+
+        Consumes the iterable in a single pass, folding rows in batches of
+        at most BATCH_ROWS, so memory stays flat however many files a
+        generator yields. Files that fail to parse are skipped as a whole
+        and logged.
+        """
+        state = cls()
+        columns = SubmissionColumns()
+        for filename, content in csv_files:
+            columns.append_csv(filename, content)
+            state.files += 1
+            state.cursor = max(state.cursor, filename)
+            if len(columns) >= cls.BATCH_ROWS:
+                state.add_columns(columns)
+                columns = SubmissionColumns()
+        state.add_columns(columns)
+        return state
+
+    def add_rows(self, rows, filename='', today=None):
+        """Fold already-parsed CSV rows (dicts) into the state.
+
+        Args:
+            rows: The CSV rows.
+            filename: The submission's file name or path, which carries
+                its timestamp. Counted as a folded file even if its rows
+                turn out to be unusable, as in from_csv_files().
+            today: Day ordinal as of which sealed time buckets refuse the
+                rows; they still count towards everything else.
+
+        Raises:
+            ValueError, TypeError: If any row is unusable; no rows are added.
+        """
+        if filename:
+            self.files += 1
+            self.cursor = max(self.cursor, filename.rpartition('/')[2])
+        columns = SubmissionColumns()
+        day = submission_day(filename)
+        for row in rows:
+            columns.append_row(row, day)
+        self.add_columns(columns, today)
+
+    def add_columns(self, columns, today=None):
+        """Fold a SubmissionColumns batch into the state; see add_rows() for today."""
+        if not len(columns):
+            return
+        self.submissions += len(columns)
+        self.sleep_hours.extend(columns.sleep_hours)
+        self.rest_violations.extend(columns.rest_violations)
+        self.sleep_quantiles.extend(columns.sleep_hours)
+        self.violation_quantiles.extend(columns.rest_violations)
+        for ship_type, count in columns.ship_type.counts().items():
+            self.by_ship[ship_type] = self.by_ship.get(ship_type, 0) + count
+        for region, count in columns.region.counts().items():
+            self.by_region[region] = self.by_region.get(region, 0) + count
+        self.cube.add_columns(columns)
+        self.daily.add_columns(columns, today)
+        self.weekly.add_columns(columns, today)
+
+    def merge(self, other, today=None):
+        """Merge another state into this one in place; see add_rows() for today."""
+        self.files += other.files
+        self.cursor = max(self.cursor, other.cursor)
+        self.submissions += other.submissions
+        self.sleep_hours.merge(other.sleep_hours)
+        self.rest_violations.merge(other.rest_violations)
+        self.sleep_quantiles.merge(other.sleep_quantiles)
+        self.violation_quantiles.merge(other.violation_quantiles)
+        for ship_type, count in other.by_ship.items():
+            self.by_ship[ship_type] = self.by_ship.get(ship_type, 0) + count
+        for region, count in other.by_region.items():
+            self.by_region[region] = self.by_region.get(region, 0) + count
+        self.cube.merge(other.cube)
+        self.daily.merge(other.daily, today)
+        self.weekly.merge(other.weekly, today)
+        return self
+
+    def copy(self):
+        return AggregateState().merge(self)
+
+    def to_snapshot(self):
+        """Return the full state as a JSON-serializable dict.
+
+        Sums are stored as their exact partials and categorical tallies as
+        ordered pairs, so from_snapshot() restores an identical state.
+        """
+        return {
+            "version": self.SNAPSHOT_VERSION,
+            "files": self.files,
+            "cursor": self.cursor,
+            "submissions": self.submissions,
+            "sleepHours": self.sleep_hours.partials,
+            "restViolations": self.rest_violations.partials,
+            "sleepQuantiles": self.sleep_quantiles.dump(),
+            "violationQuantiles": self.violation_quantiles.dump(),
+            "byShip": [[ship_type, count] for ship_type, count in self.by_ship.items()],
+            "byRegion": [[region, count] for region, count in self.by_region.items()],
+            "cube": self.cube.dump(),
+            "daily": self.daily.dump(),
+            "weekly": self.weekly.dump(),
+        }
+
+    @classmethod
+    def from_snapshot(cls, snapshot):
+        """Restore a state from to_snapshot() output.
+
+        Raises:
+            ValueError: If the snapshot has a different SNAPSHOT_VERSION.
+        """
+        if snapshot.get("version") != cls.SNAPSHOT_VERSION:
+            raise ValueError(f"unsupported snapshot version {snapshot.get('version')!r}")
+        state = cls()
+        state.files = snapshot["files"]
+        state.cursor = snapshot["cursor"]
+        state.submissions = snapshot["submissions"]
+        state.sleep_hours = _ExactSum(snapshot["sleepHours"])
+        state.rest_violations = _ExactSum(snapshot["restViolations"])
+        state.sleep_quantiles.load(snapshot["sleepQuantiles"])
+        state.violation_quantiles.load(snapshot["violationQuantiles"])
+        state.by_ship = dict(snapshot["byShip"])
+        state.by_region = dict(snapshot["byRegion"])
+        state.cube.load(snapshot["cube"])
+        state.daily.load(snapshot["daily"])
+        state.weekly.load(snapshot["weekly"])
+        return state
+
+    def to_data(self):
+        """Render the state in the ``data.json`` schema."""
+        now = datetime.utcnow()
+        today = now.toordinal()
+        total = self.submissions
+        avg_sleep = self.sleep_hours.value / total if total > 0 else 0
+        avg_violations = self.rest_violations.value / total if total > 0 else 0
+        return {
+            "totals": {"submissions": total},
+            "averages": {
+                "sleepHours": round(avg_sleep, 2),
+                "restViolations": round(avg_violations, 2)
+            },
+            "percentiles": {
+                "sleepHours": _percentiles(self.sleep_quantiles),
+                "restViolations": _percentiles(self.violation_quantiles)
+            },
+            "byShip": dict(self.by_ship),
+            "byRegion": dict(self.by_region),
+            "cube": self.cube.to_data(),
+            "trends": {
+                "daily": self.daily.to_data(today, limit=self.PUBLISHED_DAYS),
+                "weekly": self.weekly.to_data(today)
+            },
+            "updatedAt": now.isoformat() + "+00:00"
+        }
+
+
+# Aggregate state of every committed submission, kept warm between uploads.
+# It is only trusted while main is still at the commit this instance last
+# made, or data/state.json still has the SHA this instance last wrote;
+# otherwise another instance has written since and we resume from its
+# snapshot.
+_aggregate_state = None
+_aggregate_head = None
+
+# Serializes the read-modify-commit cycles of update_aggregated_data() and
+# rebuild_aggregated_data(), which share the module state above along with
+# _branch_head, _committed_shas and _dedup_shards. Concurrent uploads in
+# one process (a threaded server, or the async worker next to a request)
+# would otherwise overwrite a newer aggregate with an older one.
+_aggregate_lock = threading.Lock()
+
+
+def aggregate_submissions(csv_files):
+    """Aggregate CSV submissions and calculate metrics.
+    
+    Args:
+        csv_files: Iterable of tuples (filename, content), consumed lazily
+    
+    Returns:
+        Dictionary with aggregated data
+    """
+    return AggregateState.from_csv_files(csv_files).to_data()
+
+
+# Blob SHA of the last version of each aggregate file this instance
+# committed, used to tell whether someone else has written it since.
+_committed_shas = {}
+
+
+def get_file_sha(filename):
+    """Return the current blob SHA of a file in the repository.
+
+    Args:
+        filename: Path relative to the repo root.
+
+    Returns:
+        The SHA string, or None if the file does not exist or the lookup failed.
+    """
+    if not github.configured:
+        return None
+
+    response = github.get(f"/contents/{filename}")
+    if response.status_code == 200:
+        return response.json().get('sha')
+    return None
+
+
+# (commit SHA, tree SHA) of main as of this instance's last atomic commit,
+# used as the parent of the next one without asking GitHub first.
+_branch_head = None
+
+
+def _fetch_branch_head():
+    """Return (commit SHA, tree SHA) of the main branch."""
+    response = github.get("/git/ref/heads/main")
+    response.raise_for_status()
+    commit_sha = response.json()['object']['sha']
+    response = github.get(f"/git/commits/{commit_sha}")
+    response.raise_for_status()
+    return commit_sha, response.json()['tree']['sha']
+
+
+def _tree_entry(path, content):
+    """Build a Git Trees API entry, inlining text and uploading anything else as a blob."""
+    entry = {"path": path, "mode": "100644", "type": "blob"}
+    try:
+        entry["content"] = content.decode('utf-8')
+        return entry
+    except UnicodeDecodeError:
+        pass
+    response = github.post(
+        "/git/blobs",
+        json={"content": base64.b64encode(content).decode('utf-8'), "encoding": "base64"},
+    )
+    response.raise_for_status()
+    entry["sha"] = response.json()['sha']
+    return entry
+
+
+def commit_files_to_github(prepare_files, message, max_attempts=3):
+    """Commit several files in a single commit via the Git Data API.
+
+    Builds a tree on top of the current head, creates a commit and
+    fast-forwards ``main`` to it. If the ref moved in the meantime the
+    update is rejected, so the head is re-read and the commit rebuilt, up
+    to max_attempts times. The head from this instance's previous commit
+    is reused as the parent, so an uncontended commit costs three requests.
+
+    Args:
+        prepare_files: Callable taking the parent commit SHA and returning a
+            dict of repository path -> bytes. Called again on each retry so
+            content derived from the repository can be recomputed.
+        message: Commit message.
+        max_attempts: How many times to try before giving up.
+
+    Returns:
+        True if the commit succeeded, False otherwise.
+    """
+    global _branch_head
+    if not github.configured:
+        print("GITHUB_TOKEN or REPO_FULL_NAME environment variable not set.")
+        return False
+
+    for attempt in range(max_attempts):
+        if _branch_head is None:
+            _branch_head = _fetch_branch_head()
+        parent_sha, base_tree_sha = _branch_head
+
+        files = prepare_files(parent_sha)
+        tree = [_tree_entry(path, content) for path, content in files.items()]
+        response = github.post("/git/trees", json={"base_tree": base_tree_sha, "tree": tree})
+        if response.status_code != 201:
+            print(f"GitHub API returned {response.status_code} creating tree: {response.text}")
+            _branch_head = None
+            continue
+        tree_sha = response.json()['sha']
+
+        response = github.post(
+            "/git/commits",
+            json={"message": message, "tree": tree_sha, "parents": [parent_sha]},
+        )
+        if response.status_code != 201:
+            print(f"GitHub API returned {response.status_code} creating commit: {response.text}")
+            _branch_head = None
+            continue
+        commit_sha = response.json()['sha']
+
+        response = github.patch("/git/refs/heads/main", json={"sha": commit_sha, "force": False})
+        if response.status_code == 200:
+            _branch_head = (commit_sha, tree_sha)
+            for path, content in files.items():
+                if not path.startswith('submissions/'):
+                    _committed_shas[path] = git_blob_sha(content)
+            return True
+
+        # 422 means main moved since we read it; anything else is retried the same way
+        print(f"Ref update rejected with {response.status_code} (attempt {attempt + 1}); retrying")
+        _branch_head = None
+
+    return False
+
+
+def _render_data_json(state):
+    """Render an aggregate state as the bytes of data.json."""
+    return json.dumps(state.to_data(), indent=2).encode('utf-8')
+
+
+def _render_state_json(state):
+    """Render an aggregate state as the bytes of the state.json snapshot."""
+    return json.dumps(state.to_snapshot(), separators=(',', ':')).encode('utf-8')
+
+
+def _aggregate_files(state):
+    """Return the published files for an aggregate state, path -> bytes."""
+    return {
+        'data/data.json': _render_data_json(state),
+        'data/state.json': _render_state_json(state),
+    }
+
+
+def get_repo_file(path):
+    """Return the content of a file on main.
+
+    The contents API inlines files up to 1 MB; larger files are read as a
+    raw blob by the SHA it returns.
+
+    Returns:
+        The file's bytes, or None if it does not exist.
+
+    Raises:
+        requests.HTTPError: If the file could not be fetched.
+    """
+    response = github.get(f"/contents/{path}")
+    if response.status_code == 404:
+        return None
+    response.raise_for_status()
+    info = response.json()
+    if info.get('content'):
+        return base64.b64decode(info['content'])
+    response = github.get(
+        f"/git/blobs/{info['sha']}",
+        headers={"Accept": "application/vnd.github.raw"},
+        conditional=False,
+    )
+    response.raise_for_status()
+    return response.content
+
+
+def load_state_snapshot():
+    """Load the aggregate state snapshot committed as data/state.json.
+
+    Returns:
+        The AggregateState, or None if there is no usable snapshot.
+
+    Raises:
+        requests.RequestException: If the snapshot could not be fetched;
+            a transient failure must not trigger a rebuild.
+    """
+    if not github.configured:
+        return None
+    content = get_repo_file('data/state.json')
+    if content is None:
+        return None
+    try:
+        return AggregateState.from_snapshot(json.loads(content))
+    except (ValueError, KeyError, TypeError) as e:
+        print(f"Ignoring unusable state snapshot: {e}")
+        return None
+
+
+def _csv_file_chunks(csv_files, chunk_bytes):
+    """Group (filename, content) tuples into lists of about chunk_bytes each."""
+    chunk, size = [], 0
+    for csv_file in csv_files:
+        chunk.append(csv_file)
+        size += len(csv_file[1])
+        if size >= chunk_bytes:
+            yield chunk
+            chunk, size = [], 0
+    if chunk:
+        yield chunk
+
+
+def aggregate_in_processes(csv_files, processes, chunk_bytes=4 * 1024 * 1024):
+    """Aggregate CSV files on a process pool, map-reduce style.
+
+    Files are still fetched in this process (downloads are I/O bound and
+    already threaded); consecutive runs of about chunk_bytes are parsed
+    and folded into partial states by the workers, and the partials are
+    merged back in file order. Exact sums and first-seen label order make
+    the result identical to AggregateState.from_csv_files(csv_files).
+
+    Args:
+        csv_files: Iterable of (filename, content) tuples.
+        processes: Number of worker processes.
+        chunk_bytes: Approximate CSV bytes handed to a worker at a time.
+
+    Returns:
+        The merged AggregateState.
+    """
+    # Forking a process that runs threads (the queue worker, pooled HTTP
+    # connections) can copy a lock mid-use into the child, so workers are
+    # started fresh and only import this module.
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+    state = AggregateState()
+    with ProcessPoolExecutor(max_workers=processes, mp_context=context) as executor:
+        pending = deque()
+        for chunk in _csv_file_chunks(csv_files, chunk_bytes):
+            pending.append(executor.submit(AggregateState.from_csv_files, chunk))
+            if len(pending) >= 2 * processes:
+                state.merge(pending.popleft().result())
+        while pending:
+            state.merge(pending.popleft().result())
+    return state
+
+
+def _aggregate_archive():
+    """Fetch all CSV files and aggregate them from scratch.
+
+    In ``contents`` mode a submissions folder too large to list is read
+    from the tarball instead.
+
+    Raises:
+        requests.RequestException: If any file could not be fetched.
+    """
+    csv_files = None
+    if INGEST_MODE != 'archive':
+        try:
+            csv_files = iter_csv_files_from_github(list_submission_files())
+        except TruncatedListing as e:
+            print(f"{e}; reading the archive instead")
+    if csv_files is None:
+        csv_files = iter_csv_files_from_archive()
+
+    if REBUILD_PROCESSES > 1:
+        state = aggregate_in_processes(csv_files, REBUILD_PROCESSES)
+    else:
+        state = AggregateState.from_csv_files(csv_files)
+    print(f"Aggregated {state.submissions} submissions")
+    return state
+
+
+def _resume_aggregate_state():
+    """Load the committed snapshot and fold in any submissions it lacks.
+
+    Only files named after the snapshot's cursor are fetched. If the files
+    up to the cursor don't match what the snapshot counted (a file was
+    added out of order, or the snapshot is missing or from another
+    version), or the folder is too large to list, the aggregate is
+    rebuilt from the archive instead.
+
+    Raises:
+        requests.RequestException: If the snapshot, the listing or a
+            missing file could not be fetched. Nothing is rebuilt then.
+    """
+    state = load_state_snapshot()
+    if state is None:
+        return _aggregate_archive()
+    try:
+        files = list_submission_files()
+    except TruncatedListing as e:
+        print(f"{e}; rebuilding")
+        return _aggregate_archive()
+    missing = [entry for entry in files if entry['name'] > state.cursor]
+    if len(files) - len(missing) != state.files:
+        print(f"State snapshot covers {state.files} files, expected {len(files) - len(missing)}; rebuilding")
+        return _aggregate_archive()
+    if missing:
+        # Files added behind the backend's back may be dated into sealed buckets
+        state.merge(AggregateState.from_csv_files(iter_csv_files_from_github(missing)),
+                    today=datetime.utcnow().toordinal())
+    print(f"Resumed {state.submissions} submissions from snapshot ({len(missing)} files caught up)")
+    return state
+
+
+def _current_aggregate_state(head_sha):
+    """Return the aggregate of every submission at head_sha.
+
+    Reuses the warm state when nobody else has written since this
+    instance did, and resumes from the committed snapshot otherwise.
+    """
+    global _aggregate_state, _aggregate_head
+    if _aggregate_state is not None and (
+            head_sha == _aggregate_head
+            or get_file_sha('data/state.json') == _committed_shas.get('data/state.json')):
+        return _aggregate_state
+    _aggregate_state = _resume_aggregate_state()
+    _aggregate_head = None
+    return _aggregate_state
+
+
+class StatsCache:
+    """The published data.json, held in memory for ``GET /stats``.
+
+    Commits made by this instance hand their freshly rendered data.json
+    straight to publish(). Otherwise the cached copy is served for
+    max_age seconds, then for up to stale_while_revalidate seconds more
+    while a background thread revalidates it against GitHub (a
+    conditional request, usually a 304); past that, or on a cold
+    instance, the request waits for the fetch.
+
+    Only one refresh runs at a time: other requests keep getting the
+    cached copy, however old, or on a cold instance wait for that same
+    fetch. After a failed refresh the next one is held off for
+    RETRY_MIN seconds, doubling up to RETRY_MAX, and the stale copy is
+    served meanwhile, so an outage never makes /stats wait on GitHub.
+
+    The ETag is the git blob SHA of the body, so every instance serving
+    the same data.json agrees on it.
+    """
+
+    RETRY_MIN = 5
+    RETRY_MAX = 300
+
+    def __init__(self, max_age, stale_while_revalidate):
+        self.max_age = max_age
+        self.stale_while_revalidate = stale_while_revalidate
+        self._body = None
+        self._etag = None
+        self._fetched_at = 0.0
+        self._refreshing = None  # Event set when the running refresh ends
+        self._failures = 0
+        self._retry_at = 0.0
+        self._lock = threading.Lock()
+
+    def publish(self, body):
+        """Replace the cached body, e.g. with data.json just committed."""
+        with self._lock:
+            self._body, self._etag = bytes(body), git_blob_sha(body)
+            self._fetched_at = time.monotonic()
+            self._failures = 0
+            self._retry_at = 0.0
+
+    def _refresh(self, done):
+        body = None
+        try:
+            body = get_repo_file('data/data.json')
+            if body is not None:
+                self.publish(body)
+        except Exception as e:
+            print(f"Error refreshing stats: {e}")
+        with self._lock:
+            if body is None:
+                self._failures += 1
+                backoff = min(self.RETRY_MAX, self.RETRY_MIN * 2 ** (self._failures - 1))
+                self._retry_at = time.monotonic() + backoff
+            self._refreshing = None
+        done.set()
+
+    def get(self):
+        """Return (body, etag), or (None, None) if there is nothing to serve."""
+        with self._lock:
+            now = time.monotonic()
+            body, etag = self._body, self._etag
+            age = now - self._fetched_at
+            done = self._refreshing
+            started = (github.configured and done is None and now >= self._retry_at
+                       and (body is None or age > self.max_age))
+            if started:
+                done = self._refreshing = threading.Event()
+        if started:
+            if body is not None and age <= self.max_age + self.stale_while_revalidate:
+                threading.Thread(target=self._refresh, args=(done,), name="stats-refresh", daemon=True).start()
+                return body, etag
+            self._refresh(done)
+        elif body is None and done is not None:
+            # Cold: share the fetch that is already running
+            done.wait()
+        else:
+            return body, etag
+        with self._lock:
+            return self._body, self._etag
+
+
+# Seconds /stats may be served from memory (and caches) before revalidating,
+# and how much longer a stale copy may be served while that happens.
+STATS_MAX_AGE = int(os.getenv("STATS_MAX_AGE", "60"))
+STATS_STALE_WHILE_REVALIDATE = int(os.getenv("STATS_STALE_WHILE_REVALIDATE", "600"))
+stats_cache = StatsCache(STATS_MAX_AGE, STATS_STALE_WHILE_REVALIDATE)
+
+
+def rebuild_aggregated_data():
+    """Aggregate all CSV files from scratch and commit data.json and state.json.
+
+    This is the expensive O(total submissions) path. Run it explicitly
+    (``python app.py rebuild``); a cold instance falls back to it only
+    when the committed snapshot is missing or inconsistent. If main moves
+    while the rebuild is running, it is redone against the new head.
+    """
+    global _aggregate_state, _aggregate_head
+    prepared = {}
+
+    def prepare_files(head_sha):
+        prepared['state'] = _aggregate_archive()
+        prepared['files'] = _aggregate_files(prepared['state'])
+        return prepared['files']
+
+    with _aggregate_lock:
+        try:
+            success = commit_files_to_github(prepare_files, "Rebuild aggregated data")
+            _aggregate_state = prepared['state'] if success else None
+            _aggregate_head = _branch_head[0] if success else None
+            if success:
+                stats_cache.publish(prepared['files']['data/data.json'])
+            return success
+        except Exception as e:
+            print(f"Error rebuilding aggregated data: {e}")
+            return False
+
+
+# Digests of every committed submission, split by their first byte into
+# data/dedup/<xx>.txt files of sorted fixed-width hex lines. Digests scoped
+# to a client address are keyed with DEDUP_KEY so the public files can't be
+# used to test guessed IPs. The key must be set explicitly: it can't follow
+# GITHUB_TOKEN, whose rotation would make every earlier digest
+# unrecognizable. Without it only submissions carrying an idempotency key
+# are checked, since their digests reveal nothing.
+DEDUP_KEY = os.getenv("DEDUP_KEY", "").encode('utf-8')
+DEDUP_DIGEST_SIZE = 16
+DEDUP_RECORD_SIZE = 2 * DEDUP_DIGEST_SIZE + 1
+
+# Shards this instance last committed, valid while main is at _aggregate_head.
+_dedup_shards = {}
+
+
+class DuplicateSubmission(Exception):
+    """Raised when a submission's digest is already in the dedup index."""
+
+
+def submission_digest(rows, scope, key=None, day=None):
+    """Return the dedup digest of a submission.
+
+    Rows are reduced to the known columns with whitespace stripped and
+    numbers in canonical form, then sorted, so a resubmitted file matches
+    whatever its formatting or row order. The digest is scoped to a
+    client and a UTC day: two crews can honestly report identical
+    figures, and so can one crew on different days, but a retry or a
+    double submit happens within moments.
+
+    Args:
+        rows: Parsed CSV rows (dicts).
+        scope: Who sent it: ``key:<idempotency key>`` if the form has
+            one, otherwise ``ip:<client address>``.
+        key: HMAC key, or None for a plain SHA-256. Only a scope that
+            reveals nothing about the client may go unkeyed.
+        day: Day ordinal the submission was received on, default today (UTC).
+
+    Returns:
+        The first DEDUP_DIGEST_SIZE bytes of the (HMAC-)SHA256.
+    """
+    normalized = []
+    for row in rows:
+        values = []
+        for field in SUBMISSION_FIELDS:
+            value = (row.get(field) or '').strip()
+            if field in ('sleep_hours', 'rest_violations'):
+                try:
+                    value = repr(float(value))
+                except ValueError:
+                    pass
+            values.append(value)
+        normalized.append('\x1f'.join(values))
+    normalized.sort()
+    if day is None:
+        day = datetime.utcnow().toordinal()
+    message = '\x1e'.join([str(day), scope or ''] + normalized).encode('utf-8')
+    if key is None:
+        return hashlib.sha256(message).digest()[:DEDUP_DIGEST_SIZE]
+    return hmac.new(key, message, hashlib.sha256).digest()[:DEDUP_DIGEST_SIZE]
+
+
+def _dedup_shard_path(digest):
+    return f"data/dedup/{digest[0]:02x}.txt"
+
+
+def _dedup_record(digest):
+    """Return a digest's line in its shard. Lowercase hex sorts like the bytes."""
+    return digest.hex().encode('ascii') + b'\n'
+
+
+def _dedup_search(shard, record):
+    """Binary-search a shard for a _dedup_record(); return (insertion offset, found)."""
+    size = DEDUP_RECORD_SIZE
+    lo, hi = 0, len(shard) // size
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if shard[mid * size:(mid + 1) * size] < record:
+            lo = mid + 1
+        else:
+            hi = mid
+    offset = lo * size
+    return offset, shard[offset:offset + size] == record
+
+
+def _load_dedup_shard(path, head_sha):
+    """Return the shard at path on main, reusing our own last write if current."""
+    if head_sha == _aggregate_head and path in _dedup_shards:
+        return _dedup_shards[path]
+    return get_repo_file(path) or b''
+
+
+def update_aggregated_data(new_rows=None, submission=None, digest=None):
+    """Fold new rows into the aggregate and commit data.json and state.json.
+
+    The submission file (if given), the refreshed data.json and the state
+    snapshot are written in one commit, so every commit on main has a
+    data.json and state.json that match its submissions. On a ref conflict
+    the aggregate is recomputed against the new head before retrying.
+    Calls within one process run one at a time.
+
+    Args:
+        new_rows: CSV rows (dicts) of the submission being added.
+        submission: Optional tuple (path, content, commit message) of the
+            submission file to commit alongside data.json.
+        digest: Optional submission_digest() of the submission. It is
+            looked up in the dedup index at the head being committed on
+            and added to it in the same commit.
+
+    Returns:
+        True if the commit succeeded, False otherwise.
+
+    Raises:
+        DuplicateSubmission: If digest is already in the dedup index.
+    """
+    global _aggregate_state, _aggregate_head
+    prepared = {}
+
+    def prepare_files(head_sha):
+        files = {}
+        if digest is not None:
+            path = _dedup_shard_path(digest)
+            shard = _load_dedup_shard(path, head_sha)
+            record = _dedup_record(digest)
+            offset, found = _dedup_search(shard, record)
+            if found:
+                raise DuplicateSubmission(submission[0] if submission is not None else '')
+            # Text shards are inlined in the tree, with no separate blob upload
+            files[path] = shard[:offset] + record + shard[offset:]
+
+        state = _current_aggregate_state(head_sha).copy()
+        try:
+            if new_rows:
+                state.add_rows(new_rows, submission[0] if submission is not None else '',
+                               today=datetime.utcnow().toordinal())
+        except Exception as e:
+            # A full rebuild skips unparseable files, so don't count it here either
+            print(f"Error aggregating new rows: {e}")
+        prepared['state'] = state
+        if submission is not None:
+            files[submission[0]] = submission[1]
+        files.update(_aggregate_files(state))
+        prepared['files'] = files
+        return files
+
+    message = "Update aggregated data"
+    if submission is not None:
+        message = f"{submission[2]}\n\nUpdate aggregated data"
+
+    with _aggregate_lock:
+        try:
+            if not commit_files_to_github(prepare_files, message):
+                return False
+            _aggregate_state = prepared['state']
+            _aggregate_head = _branch_head[0]
+            if digest is not None:
+                path = _dedup_shard_path(digest)
+                _dedup_shards[path] = prepared['files'][path]
+            stats_cache.publish(prepared['files']['data/data.json'])
+            print(f"Aggregated {_aggregate_state.submissions} submissions incrementally")
+            return True
+        except DuplicateSubmission:
+            raise
+        except Exception as e:
+            print(f"Error updating aggregated data: {e}")
+            return False
+
+
+def process_submission(filename, content, rows, digest=None):
+    """Commit a validated submission together with the refreshed aggregate.
+
+    The submission is named and dated here, when it is committed, not
+    when it was received: a queued upload may be committed much later,
+    and its rows must land in a time bucket that is still open.
+
+    Args:
+        filename: The uploaded file's (sanitized) name.
+        content: Raw bytes of the submitted CSV.
+        rows: Parsed CSV rows of the submission.
+        digest: Optional submission_digest() to deduplicate on.
+
+    Returns:
+        True if the submission was committed, False otherwise.
+
+    Raises:
+        DuplicateSubmission: If the same submission was already committed.
+    """
+    timestamp = datetime.utcnow().strftime('%Y%m%d_%H%M%S')
+    target_path = f"submissions/{timestamp}_{filename}"
+    commit_message = f"Add submission {filename} on {timestamp}"
+    return update_aggregated_data(rows, submission=(target_path, content, commit_message), digest=digest)
+
+
+# Accept uploads with 202 and commit them from a background worker. Needs a
+# host that keeps running after the response is sent; on Vercel the
+# function may be frozen as soon as the response is returned.
+ASYNC_UPLOADS = os.getenv("ASYNC_UPLOADS", "").lower() in ("1", "true", "yes")
+
+
+class SubmissionQueue:
+    """Durable on-disk queue of accepted submissions, drained by one worker per process.
+
+    Each submission is a JSON record ``<dir>/<id>.json`` written with
+    fsync and an atomic rename before the client gets its 202, so an
+    accepted submission survives a process restart on the same disk.
+    The record doubles as the status the ``/status`` endpoint reports:
+    ``queued`` -> ``processing`` -> ``done`` or ``failed``. Finished
+    records are pruned after STATUS_TTL seconds.
+
+    Several processes (e.g. gunicorn workers) may share the directory. A
+    worker only processes a record while holding an exclusive ``flock`` on
+    ``<dir>/<id>.lock``. The kernel drops that lock when its holder dies,
+    so a record still marked ``processing`` whose lock is free was
+    interrupted and is picked up again; one whose lock is held is left to
+    its owner.
+    """
+
+    STATUS_TTL = 24 * 3600
+    ID_PATTERN = re.compile(r'^[0-9]{8}T[0-9]{6}-[0-9a-f]{12}$')
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._wakeup = threading.Event()
+        self._worker = None
+        self._lock = threading.Lock()
+
+    def _path(self, submission_id):
+        return os.path.join(self.directory, f"{submission_id}.json")
+
+    def _lock_path(self, submission_id):
+        return os.path.join(self.directory, f"{submission_id}.lock")
+
+    def _write(self, record):
+        path = self._path(record['id'])
+        # A unique temporary name, so concurrent writers never share one
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix=f"{record['id']}.", suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(record, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+
+    def get(self, submission_id):
+        """Return the record for a submission ID, or None if unknown."""
+        if not self.ID_PATTERN.match(submission_id):
+            return None
+        try:
+            with open(self._path(submission_id)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def enqueue(self, filename, content, rows, digest=None):
+        """Durably store a validated submission and wake the worker.
+
+        Returns:
+            The submission ID to poll ``/status/<id>`` with.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        submission_id = f"{datetime.utcnow().strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:12]}"
+        self._write({
+            'id': submission_id,
+            'status': 'queued',
+            'filename': filename,
+            'content': base64.b64encode(content).decode('utf-8'),
+            'rows': rows,
+            'digest': digest.hex() if digest is not None else None,
+            'updated_at': time.time(),
+        })
+        self.start()
+        self._wakeup.set()
+        return submission_id
+
+    def start(self):
+        """Start the background worker if it is not running yet."""
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name="submission-worker", daemon=True)
+                self._worker.start()
+
+    def _pending(self):
+        """Return the IDs of queued or processing records, oldest first."""
+        pending = []
+        try:
+            names = sorted(os.listdir(self.directory))
+        except FileNotFoundError:
+            return pending
+        for name in names:
+            if not name.endswith('.json'):
+                continue
+            record = self.get(name[:-len('.json')])
+            if record is None:
+                continue
+            if record['status'] in ('queued', 'processing'):
+                pending.append(record['id'])
+            elif time.time() - record['updated_at'] > self.STATUS_TTL:
+                for path in (self._path(record['id']), self._lock_path(record['id'])):
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+        return pending
+
+    def _claim(self, submission_id):
+        """Take the lock on a record so no other worker processes it.
+
+        Returns:
+            The open lock file descriptor, or None if another worker
+            holds the lock.
+        """
+        fd = os.open(self._lock_path(submission_id), os.O_CREAT | os.O_RDWR, 0o600)
+        if fcntl is not None:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                os.close(fd)
+                return None
+        return fd
+
+    def _drain(self):
+        """Process every pending record this worker can claim."""
+        for submission_id in self._pending():
+            fd = self._claim(submission_id)
+            if fd is None:
+                continue
+            try:
+                # Re-read under the lock: another worker may have settled it since the listing
+                record = self.get(submission_id)
+                if record is not None and record['status'] in ('queued', 'processing'):
+                    self._process(record)
+                # Settled now, so nobody needs the lock file again
+                try:
+                    os.remove(self._lock_path(submission_id))
+                except FileNotFoundError:
+                    pass
+            finally:
+                os.close(fd)
+
+    def _run(self):
+        while True:
+            self._wakeup.clear()
+            try:
+                self._drain()
+            except OSError as e:
+                print(f"Error draining the submission queue: {e}")
+            self._wakeup.wait(timeout=60)
+
+    def _process(self, record):
+        record['status'] = 'processing'
+        record['updated_at'] = time.time()
+        self._write(record)
+        try:
+            success = process_submission(
+                record['filename'],
+                base64.b64decode(record['content']),
+                record['rows'],
+                bytes.fromhex(record['digest']) if record.get('digest') else None,
+            )
+            error = None if success else 'Failed to commit file to GitHub.'
+        except DuplicateSubmission:
+            error = 'This submission has already been recorded.'
+        except Exception as e:
+            print(f"Exception while processing submission {record['id']}: {e}")
+            error = 'Internal server error.'
+        record['status'] = 'failed' if error else 'done'
+        record['error'] = error
+        # The payload is no longer needed once the submission is settled.
+        record.pop('content', None)
+        record.pop('rows', None)
+        record.pop('digest', None)
+        record['updated_at'] = time.time()
+        self._write(record)
+
+
+submission_queue = SubmissionQueue(
+    os.getenv("SUBMISSION_QUEUE_DIR", os.path.join(tempfile.gettempdir(), "watch-index-queue"))
+)
+
+
+# Largest request body /upload accepts; a submission is a few hundred bytes.
+app.config['MAX_CONTENT_LENGTH'] = int(os.getenv("MAX_UPLOAD_BYTES", str(256 * 1024)))
+
+
+def client_ip(environ):
+    """Return the client address of a request, honouring X-Forwarded-For."""
+    forwarded = environ.get('HTTP_X_FORWARDED_FOR')
+    if forwarded:
+        return forwarded.split(',')[0].strip()
+    return environ.get('REMOTE_ADDR')
+
+
+class UploadAdmission:
+    """WSGI middleware that admits or rejects uploads from headers alone.
+
+    Runs before Flask sees the request, so an upload without a
+    Content-Length, one larger than MAX_CONTENT_LENGTH, or one from a
+    rate-limited client is answered without a byte of the body being
+    read or parsed. Admitted requests have already used their rate-limit
+    slot. Rejections carry the CORS headers flask_cors would have added,
+    so the frontend can show the error.
+    """
+
+    def __init__(self, wsgi_app, flask_app):
+        self.wsgi_app = wsgi_app
+        self.flask_app = flask_app
+
+    def _reject(self, environ, start_response, status, message):
+        headers = [('Content-Type', 'application/json')]
+        origin = environ.get('HTTP_ORIGIN')
+        if origin in ALLOWED_ORIGINS:
+            headers += [('Access-Control-Allow-Origin', origin), ('Vary', 'Origin')]
+        body = json.dumps({'error': message}).encode('utf-8')
+        headers.append(('Content-Length', str(len(body))))
+        start_response(status, headers)
+        return [body]
+
+    def __call__(self, environ, start_response):
+        if environ.get('REQUEST_METHOD') != 'POST' or environ.get('PATH_INFO') != '/upload':
+            return self.wsgi_app(environ, start_response)
+
+        try:
+            length = int(environ.get('CONTENT_LENGTH') or '')
+        except ValueError:
+            return self._reject(environ, start_response, '411 Length Required',
+                                'Content-Length is required.')
+        limit = self.flask_app.config['MAX_CONTENT_LENGTH']
+        if limit is not None and length > limit:
+            return self._reject(environ, start_response, '413 Request Entity Too Large',
+                                f'Submission too large (limit {limit} bytes).')
+
+        allowed, wait_time = check_rate_limit(client_ip(environ))
+        if not allowed:
+            hours_remaining = wait_time // 3600
+            minutes_remaining = (wait_time % 3600) // 60
+            return self._reject(
+                environ, start_response, '429 Too Many Requests',
+                f'Rate limit exceeded. Please wait {hours_remaining}h {minutes_remaining}m before submitting again.')
+
+        return self.wsgi_app(environ, start_response)
+
+
+app.wsgi_app = UploadAdmission(app.wsgi_app, app)
+
+
+class StreamingUpload:
+    """A multipart/form-data body parsed incrementally off the request stream.
+
+    file_chunks() yields the data of the first file part named file_field
+    as it is read off the socket, appending it to ``content``, the one
+    buffer the upload is kept in. Ordinary fields seen along the way are
+    collected into ``fields``; other file parts are discarded.
+
+    The stream is read in the same 64 KiB chunks as Werkzeug's own form
+    parser, so the shared MultipartDecoder sees exactly the reads it
+    would under request.form.
+    """
+
+    def __init__(self, stream, boundary, file_field, chunk_size=64 * 1024):
+        self.stream = stream
+        self.boundary = boundary
+        self.file_field = file_field
+        self.chunk_size = chunk_size
+        self.fields = {}
+        self.filename = None
+        self.content = bytearray()
+
+    def file_chunks(self):
+        """Yield the file's data chunks, then read the rest of the body."""
+        decoder = MultipartDecoder(self.boundary)
+        in_file = False
+        field = None
+        while True:
+            data = self.stream.read(self.chunk_size)
+            decoder.receive_data(data or None)
+            event = decoder.next_event()
+            while not isinstance(event, (Epilogue, NeedData)):
+                if isinstance(event, File):
+                    in_file = event.name == self.file_field and self.filename is None
+                    if in_file:
+                        self.filename = event.filename
+                    field = None
+                elif isinstance(event, Field):
+                    in_file = False
+                    field = (event.name, [])
+                elif isinstance(event, Data):
+                    if in_file and event.data:
+                        self.content += event.data
+                        yield event.data
+                    elif field is not None:
+                        field[1].append(event.data)
+                        if not event.more_data:
+                            # Like request.form.get(), the first value of a field wins
+                            self.fields.setdefault(field[0], b''.join(field[1]).decode('utf-8', 'replace'))
+                    if not event.more_data:
+                        in_file = False
+                        field = None
+                event = decoder.next_event()
+            if not data:
+                return
+
+
+def iter_text_lines(chunks):
+    """Incrementally decode UTF-8 byte chunks into lines.
+
+    Lines are split on ``\n`` only and keep their line ending, as when
+    iterating a StringIO, so csv can parse them without the whole text
+    ever being decoded at once.
+
+    Raises:
+        UnicodeDecodeError: If the bytes are not valid UTF-8.
+    """
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    pending = ''
+    for chunk in chunks:
+        lines = (pending + decoder.decode(chunk)).split('\n')
+        pending = lines.pop()
+        for line in lines:
+            yield line + '\n'
+    pending += decoder.decode(b'', final=True)
+    if pending:
+        yield pending
+
+
+@app.route('/upload', methods=['POST'])
+def upload_file():
+    """Endpoint to handle file submissions and commit them to GitHub.
+
+    Expects a multipart/form-data POST request with a file field named
+    "submission" containing a CSV file. The file will be stored in the
+    `submissions/` directory of the configured repository.
+    
+    With ASYNC_UPLOADS enabled the submission is validated, queued and
+    answered with 202 and a submission ID; the commit and aggregation run
+    in the background and can be polled at ``/status/<id>``.
+    
+    Security features:
+    - Rate limiting: 1 submission per IP per 24 hours, enforced together
+      with the body size limit by UploadAdmission before this view runs
+    - Deduplication: a resubmission of the same rows on the same UTC day
+      with the same ``idempotency_key`` form field (or, without one, from
+      the same IP) is rejected with 409 instead of being counted twice
+    - Data validation: Checks for reasonable values
+    - Honeypot detection: Rejects submissions with honeypot field filled
+    """
+    # Get client IP address (handle proxies); the rate limit has already
+    # been checked by UploadAdmission
+    ip_address = client_ip(request.environ)
+    
+    boundary = request.mimetype_params.get('boundary')
+    if request.mimetype != 'multipart/form-data' or not boundary:
+        return jsonify({'error': 'No submission file provided.'}), 400
+    
+    try:
+        # Parse the CSV as it streams in, validating the first (and should
+        # be only) row as soon as it has arrived; the raw bytes are kept
+        # in a single buffer for the commit
+        upload = StreamingUpload(request.stream, boundary.encode('latin-1'), 'submission')
+        rows = []
+        parse_error = None
+        validation_error = None
+        try:
+            for row in iter_submission_rows(iter_text_lines(upload.file_chunks())):
+                if not rows:
+                    valid, validation_error = validate_submission_data(row)
+                    if not valid:
+                        break
+                rows.append(row)
+        except RequestEntityTooLarge:
+            raise
+        except Exception as e:
+            parse_error = e
+        
+        # Check for honeypot field (bot detection)
+        honeypot_value = upload.fields.get('website', '')
+        if honeypot_value:
+            # This is likely a bot - honeypot field should be empty
+            print(f"Honeypot triggered from IP: {ip_address}")
+            return jsonify({'error': 'Invalid submission.'}), 400
+        
+        if upload.filename is None:
+            return jsonify({'error': 'No submission file provided.'}), 400
+        if upload.filename == '':
+            return jsonify({'error': 'Empty filename.'}), 400
+        
+        if parse_error is not None:
+            return jsonify({'error': f'Invalid CSV format: {str(parse_error)}'}), 400
+        if validation_error:
+            return jsonify({'error': validation_error}), 400
+        if not rows:
+            return jsonify({'error': 'Empty CSV file.'}), 400
+        content = upload.content
+        
+        # Proceed with committing the file; it is timestamped when committed
+        safe_filename = upload.filename.replace("..", "_")
+        digest = None
+        idempotency_key = upload.fields.get('idempotency_key')
+        if idempotency_key:
+            digest = submission_digest(rows, f"key:{idempotency_key}")
+        elif DEDUP_KEY:
+            digest = submission_digest(rows, f"ip:{ip_address}", DEDUP_KEY)
+        
+        if ASYNC_UPLOADS:
+            submission_id = submission_queue.enqueue(safe_filename, content, rows, digest)
+            return jsonify({'status': 'queued', 'id': submission_id}), 202
+        
+        try:
+            success = process_submission(safe_filename, content, rows, digest)
+        except DuplicateSubmission:
+            return jsonify({'error': 'This submission has already been recorded.'}), 409
+        
+        if success:
+            return jsonify({'status': 'success'}), 200
+        else:
+            return jsonify({'error': 'Failed to commit file to GitHub.'}), 500
+            
+    except RequestEntityTooLarge:
+        raise
+    except Exception as e:
+        print(f"Exception while processing upload: {e}")
+        return jsonify({'error': 'Internal server error.'}), 500
+
+
+@app.route('/status/<submission_id>', methods=['GET'])
+def submission_status(submission_id):
+    """Report the progress of a submission accepted in async mode.
+
+    Returns the queue record's ``status`` (``queued``, ``processing``,
+    ``done`` or ``failed``) and, for failures, an ``error`` message.
+    """
+    record = submission_queue.get(submission_id)
+    if record is None:
+        return jsonify({'error': 'Unknown submission.'}), 404
+    response = {'id': record['id'], 'status': record['status']}
+    if record.get('error'):
+        response['error'] = record['error']
+    return jsonify(response), 200
+
+
+@app.route('/stats', methods=['GET'])
+def get_stats():
+    """Serve the published aggregate (the contents of data/data.json).
+
+    Answered from StatsCache with a strong ETag, so a matching
+    If-None-Match gets a bodyless 304, and with Cache-Control letting
+    browsers and the CDN reuse it for STATS_MAX_AGE seconds and serve it
+    stale while revalidating for STATS_STALE_WHILE_REVALIDATE more.
+    """
+    body, etag = stats_cache.get()
+    if body is None:
+        return jsonify({'error': 'Statistics are not available yet.'}), 503
+    response = app.response_class(body, mimetype='application/json')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = (
+        f"public, max-age={STATS_MAX_AGE}, stale-while-revalidate={STATS_STALE_WHILE_REVALIDATE}"
+    )
+    return response.make_conditional(request)
+
 
 # For Vercel: expose the Flask app as a WSGI callable
 if __name__ == '__main__':
+    if sys.argv[1:] == ['rebuild']:
+        sys.exit(0 if rebuild_aggregated_data() else 1)
     app.run(host='0.0.0.0', port=int(os.environ.get('PORT', 8000)))
@@ -0,0 +1,83 @@
+"""Compare the fixed-schema CSV path against csv.DictReader.
+
+Generates synthetic submissions and times parsing them into columns both
+ways, plus the row-dict parse used by ``/upload``. Run from the repository
+root:
+
+    python benchmarks/csv_parse.py [files] [rows per file]
+"""
+import csv
+import os
+import random
+import sys
+import time
+from io import StringIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import SubmissionColumns, read_submission_rows, submission_day  # noqa: E402
+
+HEADER = 'sleep_hours,rest_violations,ship_type,region,called_during_rest,port_intensity\n'
+
+
+def make_files(count, rows_per_file):
+    rng = random.Random(0)
+    files = []
+    for i in range(count):
+        rows = ''.join(
+            f"{rng.uniform(0, 24):.1f},{rng.randint(0, 50)},"
+            f"{rng.choice(['Tanker', 'Bulk', 'Container', 'Gas', 'Other'])},"
+            f"{rng.choice(['Global', 'Europe', 'Middle East', 'Asia', 'Africa', 'Americas'])},"
+            f"{rng.choice(['Yes', 'No'])},{rng.choice(['Low', 'Medium', 'High'])}\n"
+            for _ in range(rows_per_file)
+        )
+        files.append((f"20250101_{i:06d}_bench.csv", HEADER + rows))
+    return files
+
+
+def dictreader_columns(files):
+    columns = SubmissionColumns()
+    for filename, content in files:
+        day = submission_day(filename)
+        for row in csv.DictReader(StringIO(content)):
+            columns.append_row(row, day)
+    return columns
+
+
+def fast_columns(files):
+    columns = SubmissionColumns()
+    for filename, content in files:
+        columns.append_csv(filename, content)
+    return columns
+
+
+def best_of(fn, *args, repeat=5):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    rows_per_file = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    files = make_files(count, rows_per_file)
+    total = count * rows_per_file
+    assert len(dictreader_columns(files)) == len(fast_columns(files)) == total
+
+    for label, slow, fast in (
+        ("columns", dictreader_columns, fast_columns),
+        ("upload rows", lambda fs: [list(csv.DictReader(StringIO(c))) for _, c in fs],
+         lambda fs: [read_submission_rows(c) for _, c in fs]),
+    ):
+        slow_time = best_of(slow, files)
+        fast_time = best_of(fast, files)
+        print(f"{label:12} DictReader {total / slow_time / 1e6:5.2f} Mrows/s   "
+              f"fixed schema {total / fast_time / 1e6:5.2f} Mrows/s   "
+              f"speedup {slow_time / fast_time:.2f}x")
+
+
+if __name__ == '__main__':
+    main()
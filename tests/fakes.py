@@ -0,0 +1,345 @@
+"""Local stand-ins for the services app.py talks to, served on real sockets.
+
+FakeRedis speaks just enough RESP for RedisRateLimiter; FakeGitHub serves
+the parts of the GitHub REST API the aggregation and commit paths use,
+from an in-memory repository whose commits are snapshots of path -> bytes.
+"""
+import base64
+import hashlib
+import io
+import json
+import re
+import socketserver
+import tarfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+def blob_sha(content):
+    return hashlib.sha1(b"blob %d\0" % len(content) + content).hexdigest()
+
+
+class FakeRedis:
+    """A RESP server supporting MULTI/EXEC, SET (NX, PX), INCR, DECR, PTTL,
+    PEXPIRE, AUTH and SELECT.
+
+    ``commands`` records every command received; ``drop_connections()``
+    closes the server side of every open connection, as an idle timeout
+    would, and while ``hang_up`` is positive a connection is closed right
+    after a command is read, before it is answered.
+    """
+
+    def __init__(self, password=None):
+        self.password = password
+        self.hang_up = 0
+        self.store = {}  # key -> [value, expires at (time.time()) or None]
+        self.commands = []
+        self.connections = []
+        self.lock = threading.Lock()
+        fake = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                fake.connections.append(self.request)
+                queued = None
+                while True:
+                    args = fake._read_command(self.rfile)
+                    if args is None:
+                        return
+                    with fake.lock:
+                        fake.commands.append(args)
+                        if fake.hang_up > 0:
+                            fake.hang_up -= 1
+                            return
+                        name = args[0].upper()
+                        if name == 'MULTI':
+                            queued, reply = [], b'+OK\r\n'
+                        elif name == 'EXEC':
+                            replies = [fake._run(command) for command in queued]
+                            queued, reply = None, b'*%d\r\n' % len(replies) + b''.join(replies)
+                        elif queued is not None:
+                            queued.append(args)
+                            reply = b'+QUEUED\r\n'
+                        else:
+                            reply = fake._run(args)
+                    try:
+                        self.wfile.write(reply)
+                    except OSError:
+                        return
+
+        self.server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"redis://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True).start()
+
+    def close(self):
+        self.drop_connections()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def drop_connections(self):
+        for connection in self.connections:
+            try:
+                connection.shutdown(2)
+            except OSError:
+                pass
+        self.connections = []
+
+    def incr(self, key, by=1):
+        entry = self.store.setdefault(key, ['0', None])
+        entry[0] = str(int(entry[0]) + by)
+        return int(entry[0])
+
+    def pttl(self, key):
+        if key not in self.store:
+            return -2
+        expires = self.store[key][1]
+        return -1 if expires is None else int((expires - time.time()) * 1000)
+
+    def pexpire(self, key, milliseconds):
+        if key not in self.store:
+            return 0
+        self.store[key][1] = time.time() + int(milliseconds) / 1000
+        return 1
+
+    @staticmethod
+    def _read_command(rfile):
+        line = rfile.readline()
+        if not line:
+            return None
+        args = []
+        for _ in range(int(line[1:])):
+            length = int(rfile.readline()[1:])
+            args.append(rfile.read(length + 2)[:-2].decode('utf-8'))
+        return args
+
+    @staticmethod
+    def _encode(value):
+        if value is None:
+            return b'$-1\r\n'
+        if isinstance(value, int):
+            return b':%d\r\n' % value
+        if isinstance(value, list):
+            return b'*%d\r\n' % len(value) + b''.join(FakeRedis._encode(item) for item in value)
+        if value == 'OK':
+            return b'+OK\r\n'
+        return b'$%d\r\n%s\r\n' % (len(value.encode()), value.encode())
+
+    def _run(self, args):
+        now = time.time()
+        for key in [key for key, (_, expires) in self.store.items() if expires is not None and expires <= now]:
+            del self.store[key]
+        name, key = args[0].upper(), args[1] if len(args) > 1 else None
+        if name == 'AUTH':
+            return b'+OK\r\n' if args[-1] == self.password else b'-WRONGPASS invalid password\r\n'
+        if name == 'SELECT':
+            return b'+OK\r\n'
+        if name == 'SET':
+            if 'NX' in args and key in self.store:
+                return self._encode(None)
+            expires = now + int(args[args.index('PX') + 1]) / 1000 if 'PX' in args else None
+            self.store[key] = [args[2], expires]
+            return self._encode('OK')
+        if name in ('INCR', 'DECR'):
+            return self._encode(self.incr(key, 1 if name == 'INCR' else -1))
+        if name == 'PTTL':
+            return self._encode(self.pttl(key))
+        if name == 'PEXPIRE':
+            return self._encode(self.pexpire(key, args[2]))
+        return b'-ERR unknown command\r\n'
+
+
+class FakeGitHub:
+    """An in-memory repository behind the GitHub REST API.
+
+    Serves ``/repos/<owner>/<repo>`` contents, trees, blobs, refs and
+    commits (including creating them through the Git Data API) and the
+    tarball of main. ``fail(method, pattern, status, times)`` makes the
+    next matching requests fail, and ``before_ref_update`` is called
+    (once) before the ref is moved, so a test can commit in between like
+    another instance would. Every request is answered ``latency`` seconds
+    late. While ``truncated`` is set a recursive listing
+    of main comes back truncated to its top level, as GitHub does for very
+    large trees. Listings carry an ETag, and ``not_modified`` counts the
+    304s sent for them.
+    """
+
+    def __init__(self, files=None):
+        self.objects = {}  # tree SHA -> {path: bytes}
+        self.commits = {}  # commit SHA -> (tree SHA, parent SHA)
+        self.blobs = {}
+        self.head = None
+        self.requests = []
+        self.failures = []
+        self.truncated = False
+        self.truncated_subtrees = set()
+        self.not_modified = 0
+        self.before_ref_update = None
+        self.latency = 0
+        self.lock = threading.Lock()
+        self.commit(files or {}, "Initial commit")
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _handle(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                body = json.loads(self.rfile.read(length)) if length else None
+                time.sleep(fake.latency)
+                status, payload, headers = fake.handle(self.command, self.path, self.headers, body)
+                if not isinstance(payload, bytes):
+                    payload = json.dumps(payload).encode('utf-8')
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            do_GET = do_POST = do_PATCH = _handle
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    @property
+    def files(self):
+        """The files on main."""
+        return self.objects[self.commits[self.head][0]]
+
+    def commit(self, files, message="Commit"):
+        """Commit a full snapshot of files onto main, as another writer would."""
+        tree_sha = self._store_tree(files)
+        commit_sha = hashlib.sha1(f"{tree_sha}{self.head}{message}".encode()).hexdigest()
+        self.commits[commit_sha] = (tree_sha, self.head)
+        self.head = commit_sha
+        return commit_sha
+
+    def fail(self, method, pattern, status=502, times=1):
+        self.failures.append([method, re.compile(pattern), status, times])
+
+    def requested(self, method, pattern):
+        """Return how many requests matched method and the path pattern."""
+        return sum(1 for m, path in self.requests if m == method and re.search(pattern, path))
+
+    def _store_tree(self, files):
+        tree_sha = hashlib.sha1(repr(sorted(files.items())).encode()).hexdigest()
+        self.objects[tree_sha] = dict(files)
+        return tree_sha
+
+    def _listing(self, files, directory, recursive):
+        prefix = directory + '/' if directory else ''
+        entries, seen = [], set()
+        for path, content in sorted(files.items()):
+            if not path.startswith(prefix):
+                continue
+            rest = path[len(prefix):]
+            if '/' in rest and not recursive:
+                name = rest.split('/')[0]
+                if name not in seen:
+                    seen.add(name)
+                    entries.append({'path': name, 'type': 'tree', 'sha': f"dir:{prefix}{name}"})
+                continue
+            for i, part in enumerate(rest.split('/')[:-1]):
+                name = '/'.join(rest.split('/')[:i + 1])
+                if name not in seen:
+                    seen.add(name)
+                    entries.append({'path': name, 'type': 'tree', 'sha': f"dir:{prefix}{name}"})
+            entries.append({'path': rest, 'type': 'blob', 'sha': blob_sha(content), 'size': len(content)})
+        return {'sha': directory or 'root', 'tree': entries, 'truncated': False}
+
+    def _revalidated(self, headers, payload):
+        etag = '"%s"' % hashlib.sha1(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+        if headers.get('If-None-Match') == etag:
+            self.not_modified += 1
+            return 304, b'', {'ETag': etag}
+        return 200, payload, {'ETag': etag}
+
+    def _tarball(self, files):
+        buffer = io.BytesIO()
+        with tarfile.open(fileobj=buffer, mode='w:gz') as archive:
+            for path, content in files.items():
+                member = tarfile.TarInfo(f"owner-repo-{self.head[:7]}/{path}")
+                member.size = len(content)
+                archive.addfile(member, io.BytesIO(content))
+        return buffer.getvalue()
+
+    def handle(self, method, raw_path, headers, body):
+        url = urlparse(raw_path)
+        path = re.sub(r'^/repos/[^/]+/[^/]+', '', url.path)
+        query = parse_qs(url.query)
+        with self.lock:
+            self.requests.append((method, path))
+            for failure in self.failures:
+                if failure[0] == method and failure[1].search(path) and failure[3] > 0:
+                    failure[3] -= 1
+                    return failure[2], {'message': 'Injected failure'}, {}
+            if method == 'PATCH' and self.before_ref_update is not None:
+                hook, self.before_ref_update = self.before_ref_update, None
+                hook()
+            return self._route(method, path, query, headers, body)
+
+    def _route(self, method, path, query, headers, body):
+        files = self.files
+        if method == 'GET':
+            match = re.match(r'^/contents/(.+)$', path)
+            if match:
+                if match.group(1) not in files:
+                    return 404, {'message': 'Not Found'}, {}
+                content = files[match.group(1)]
+                etag = f'"{blob_sha(content)}"'
+                if headers.get('If-None-Match') == etag:
+                    return 304, b'', {'ETag': etag}
+                return 200, {'sha': blob_sha(content), 'content': base64.b64encode(content).decode()}, {'ETag': etag}
+            if path == '/git/trees/main':
+                recursive = query.get('recursive') == ['1']
+                if recursive and self.truncated:
+                    return self._revalidated(headers, dict(self._listing(files, '', False), truncated=True))
+                return self._revalidated(headers, self._listing(files, '', recursive))
+            match = re.match(r'^/git/trees/dir:(.+)$', path)
+            if match:
+                listing = self._listing(files, match.group(1), False)
+                if match.group(1) in self.truncated_subtrees:
+                    listing = dict(listing, tree=listing['tree'][:1], truncated=True)
+                return 200, listing, {}
+            match = re.match(r'^/git/blobs/(\w+)$', path)
+            if match:
+                for content in list(files.values()) + list(self.blobs.values()):
+                    if blob_sha(content) == match.group(1):
+                        return 200, content, {}
+                return 404, {'message': 'Not Found'}, {}
+            if path == '/git/ref/heads/main':
+                return 200, {'object': {'sha': self.head}}, {}
+            match = re.match(r'^/git/commits/(\w+)$', path)
+            if match and match.group(1) in self.commits:
+                return 200, {'sha': match.group(1), 'tree': {'sha': self.commits[match.group(1)][0]}}, {}
+            if path == '/tarball/main':
+                return 200, self._tarball(files), {'Content-Type': 'application/x-gzip'}
+        if method == 'POST' and path == '/git/blobs':
+            content = base64.b64decode(body['content'])
+            self.blobs[blob_sha(content)] = content
+            return 201, {'sha': blob_sha(content)}, {}
+        if method == 'POST' and path == '/git/trees':
+            tree = dict(self.objects[body['base_tree']])
+            for entry in body['tree']:
+                tree[entry['path']] = entry['content'].encode('utf-8') if 'content' in entry else self.blobs[entry['sha']]
+            return 201, {'sha': self._store_tree(tree)}, {}
+        if method == 'POST' and path == '/git/commits':
+            commit_sha = hashlib.sha1(f"{body['tree']}{body['parents'][0]}{body['message']}".encode()).hexdigest()
+            self.commits[commit_sha] = (body['tree'], body['parents'][0])
+            return 201, {'sha': commit_sha}, {}
+        if method == 'PATCH' and path == '/git/refs/heads/main':
+            if self.commits[body['sha']][1] != self.head:
+                return 422, {'message': 'Update is not a fast forward'}, {}
+            self.head = body['sha']
+            return 200, {'object': {'sha': self.head}}, {}
+        return 404, {'message': f'Not handled: {method} {path}'}, {}
@@ -0,0 +1,96 @@
+import unittest
+from datetime import date
+
+import app
+
+
+def day(iso):
+    return date.fromisoformat(iso).toordinal()
+
+
+def columns(*days):
+    batch = app.SubmissionColumns()
+    for ordinal in days:
+        batch.append_row({'sleep_hours': '6', 'rest_violations': '1'}, ordinal)
+    return batch
+
+
+class TimeBucketsTest(unittest.TestCase):
+
+    def test_weeks_start_on_monday(self):
+        weekly = app.TimeBuckets(7)
+        monday = day('2025-01-06')
+        for iso in ('2025-01-06', '2025-01-08', '2025-01-12'):
+            self.assertEqual(weekly.period_start(day(iso)), monday)
+        self.assertEqual(weekly.period_start(day('2025-01-13')), day('2025-01-13'))
+
+    def test_days_are_their_own_period(self):
+        self.assertEqual(app.TimeBuckets(1).period_start(day('2025-01-08')), day('2025-01-08'))
+
+    def test_buckets_older_than_the_previous_period_are_sealed(self):
+        daily, weekly = app.TimeBuckets(1), app.TimeBuckets(7)
+        today = day('2025-01-08')  # a Wednesday
+        self.assertFalse(daily.is_sealed(today, today))
+        self.assertFalse(daily.is_sealed(day('2025-01-07'), today))
+        self.assertTrue(daily.is_sealed(day('2025-01-06'), today))
+        self.assertFalse(weekly.is_sealed(day('2024-12-30'), today))
+        self.assertTrue(weekly.is_sealed(day('2024-12-23'), today))
+
+    def test_sealed_buckets_refuse_rows(self):
+        daily = app.TimeBuckets(1)
+        today = day('2025-01-08')
+        daily.add_columns(columns(day('2025-01-01'), day('2025-01-07'), today, 0), today=today)
+        self.assertEqual(sorted(daily.buckets), [day('2025-01-07'), today])
+
+    def test_without_today_every_bucket_is_filled(self):
+        daily = app.TimeBuckets(1)
+        daily.add_columns(columns(day('2025-01-01'), day('2025-01-01'), 0))
+        self.assertEqual(list(daily.buckets), [day('2025-01-01')])
+        self.assertEqual(daily.buckets[day('2025-01-01')].count, 2)
+
+    def test_merge_skips_sealed_buckets(self):
+        other = app.TimeBuckets(1)
+        other.add_columns(columns(day('2025-01-01'), day('2025-01-08')))
+        daily = app.TimeBuckets(1).merge(other, today=day('2025-01-08'))
+        self.assertEqual(list(daily.buckets), [day('2025-01-08')])
+
+
+class AggregateStateTrendsTest(unittest.TestCase):
+
+    def test_rows_dated_into_a_sealed_bucket_count_only_towards_the_totals(self):
+        state = app.AggregateState()
+        rows = [{'sleep_hours': '6', 'rest_violations': '1'}]
+        today = day('2025-01-08')
+        state.add_rows(rows, '20241201_120000_late.csv', today=today)
+        state.add_rows(rows, '20250108_120000_new.csv', today=today)
+        self.assertEqual(state.submissions, 2)
+        self.assertEqual(list(state.daily.buckets), [today])
+        self.assertEqual(list(state.weekly.buckets), [day('2025-01-06')])
+
+
+class AggregateInProcessesTest(unittest.TestCase):
+
+    def test_matches_the_sequential_aggregate(self):
+        header = 'sleep_hours,rest_violations,ship_type,region,called_during_rest,port_intensity\n'
+        files = []
+        for i in range(40):
+            rows = ''.join(
+                f"{4 + (i + j) % 6}.5,{j % 3},{['Tanker', 'Gas', 'Bulk'][j % 3]},"
+                f"{['Asia', 'Europe'][i % 2]},{['Yes', 'No'][j % 2]},{['Low', 'High'][i % 2]}\n"
+                for j in range(i % 5 + 1))
+            files.append((f"202501{i % 28 + 1:02d}_120000_{i}.csv", header + rows))
+        files[5:5] = [
+            ('20250110_120000_empty.csv', ''),
+            ('20250111_120000_header_only.csv', header),
+            ('20250112_120000_bad_numbers.csv', header + 'many,none,Gas,Asia,No,Low\n'),
+            ('20250113_120000_short_rows.csv', header + '7\n8,1\n'),
+            ('20250114_120000_not_csv.csv', '\x00\x01 "unterminated\n'),
+            ('notes.csv', header + '7,1,Gas,Asia,No,Low\n'),
+        ]
+        sequential = app.AggregateState.from_csv_files(files)
+        parallel = app.aggregate_in_processes(files, 2, chunk_bytes=256)
+        self.assertEqual(parallel.to_snapshot(), sequential.to_snapshot())
+
+
+if __name__ == '__main__':
+    unittest.main()
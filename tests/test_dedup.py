@@ -0,0 +1,129 @@
+import io
+import os
+import unittest
+from unittest import mock
+
+import app
+from tests.test_github import GitHubTestCase, submission
+
+ROWS = [
+    {'sleep_hours': '7', 'rest_violations': '2', 'ship_type': 'Gas', 'region': 'Asia'},
+    {'sleep_hours': '5.5', 'rest_violations': '0', 'ship_type': 'Tanker', 'region': 'Europe'},
+]
+TODAY = 739000
+
+
+class SubmissionDigestTest(unittest.TestCase):
+
+    def test_reordered_and_reformatted_rows_match(self):
+        reformatted = [
+            {'sleep_hours': ' 5.50 ', 'rest_violations': '0.0', 'ship_type': 'Tanker ', 'region': 'Europe',
+             'extra_column': 'ignored'},
+            {'sleep_hours': '7.0', 'rest_violations': ' 2', 'ship_type': 'Gas', 'region': ' Asia'},
+        ]
+        self.assertEqual(app.submission_digest(ROWS, 'key:a', day=TODAY),
+                         app.submission_digest(reformatted, 'key:a', day=TODAY))
+
+    def test_day_and_scope_are_part_of_the_digest(self):
+        digest = app.submission_digest(ROWS, 'key:a', day=TODAY)
+        self.assertNotEqual(app.submission_digest(ROWS, 'key:a', day=TODAY + 1), digest)
+        self.assertNotEqual(app.submission_digest(ROWS, 'key:b', day=TODAY), digest)
+
+    def test_address_digests_depend_on_the_key(self):
+        digest = app.submission_digest(ROWS, 'ip:192.0.2.1', b'secret', day=TODAY)
+        self.assertEqual(len(digest), app.DEDUP_DIGEST_SIZE)
+        self.assertNotEqual(app.submission_digest(ROWS, 'ip:192.0.2.1', b'other', day=TODAY), digest)
+        self.assertNotEqual(app.submission_digest(ROWS, 'ip:192.0.2.1', day=TODAY), digest)
+
+
+class DedupShardTest(unittest.TestCase):
+
+    def test_insertion_keeps_the_shard_sorted(self):
+        shard = b''
+        records = [app._dedup_record(os.urandom(app.DEDUP_DIGEST_SIZE)) for _ in range(200)]
+        for record in records:
+            offset, found = app._dedup_search(shard, record)
+            self.assertFalse(found)
+            shard = shard[:offset] + record + shard[offset:]
+        lines = [shard[i:i + app.DEDUP_RECORD_SIZE] for i in range(0, len(shard), app.DEDUP_RECORD_SIZE)]
+        self.assertEqual(lines, sorted(records))
+        for record in records:
+            self.assertTrue(app._dedup_search(shard, record)[1])
+
+
+class DuplicateUploadTest(GitHubTestCase):
+
+    files = {'submissions/20250101_000000_a.csv': submission(7)}
+
+    def setUp(self):
+        super().setUp()
+        patches = [
+            mock.patch.object(app, 'rate_limit_store', app.ExpiringStore(60, 100)),
+            mock.patch.object(app, 'DEDUP_KEY', b''),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.assertTrue(app.rebuild_aggregated_data())
+        self.client = app.app.test_client()
+        self.addresses = iter(['192.0.2.1', '198.51.100.1', '203.0.113.1'])
+
+    def upload(self, content, idempotency_key=None):
+        address = next(self.addresses)
+        data = {'submission': (io.BytesIO(content), f"{address}.csv")}
+        if idempotency_key is not None:
+            data['idempotency_key'] = idempotency_key
+        # A new network each time, so only the duplicate check can refuse it
+        return self.client.post('/upload', data=data, environ_overrides={'REMOTE_ADDR': address})
+
+    def submissions(self):
+        return len([path for path in self.github.files if path.startswith('submissions/')])
+
+    def test_same_form_sent_twice_is_a_conflict_without_a_dedup_key(self):
+        self.assertEqual(self.upload(submission(6), 'form-1').status_code, 200)
+        self.assertEqual(self.upload(submission(6), 'form-1').status_code, 409)
+        self.assertEqual(self.submissions(), 2)
+
+    def test_another_form_with_the_same_figures_is_accepted(self):
+        self.assertEqual(self.upload(submission(6), 'form-1').status_code, 200)
+        self.assertEqual(self.upload(submission(6), 'form-2').status_code, 200)
+        self.assertEqual(self.submissions(), 3)
+
+    def test_same_form_on_the_next_day_is_accepted(self):
+        rows = [{'sleep_hours': '6', 'rest_violations': '1'}]
+        today = app.submission_digest(rows, 'key:form-1', day=TODAY)
+        tomorrow = app.submission_digest(rows, 'key:form-1', day=TODAY + 1)
+        self.assertTrue(app.process_submission('b.csv', submission(6), rows, today))
+        self.assertTrue(app.process_submission('c.csv', submission(6), rows, tomorrow))
+        with self.assertRaises(app.DuplicateSubmission):
+            app.process_submission('d.csv', submission(6), rows, today)
+
+    def test_uploads_without_a_form_key_are_not_checked_without_a_dedup_key(self):
+        self.assertEqual(self.upload(submission(6)).status_code, 200)
+        self.assertEqual(self.upload(submission(6)).status_code, 200)
+        self.assertEqual(self.submissions(), 3)
+        self.assertFalse(any(path.startswith('data/dedup/') for path in self.github.files))
+
+    def test_duplicate_committed_during_a_ref_conflict_is_rejected(self):
+        rows = [{'sleep_hours': '6', 'rest_violations': '1'}]
+        digest = app.submission_digest(rows, 'key:form-1')
+
+        def other_instance_commits_the_same_form():
+            files = dict(self.github.files)
+            files['submissions/20250102_000000_other.csv'] = submission(6)
+            files[app._dedup_shard_path(digest)] = app._dedup_record(digest)
+            state = app.AggregateState.from_csv_files(
+                (path.rpartition('/')[2], content.decode('utf-8'))
+                for path, content in sorted(files.items()) if path.startswith('submissions/'))
+            files.update(app._aggregate_files(state))
+            self.github.commit(files, "Another instance")
+
+        self.github.before_ref_update = other_instance_commits_the_same_form
+        with self.assertRaises(app.DuplicateSubmission):
+            app.process_submission('c.csv', submission(6), rows, digest)
+        self.assertEqual(self.submissions(), 2)
+        self.assertEqual(self.published()['totals']['submissions'], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
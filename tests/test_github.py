@@ -0,0 +1,281 @@
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+import requests
+
+import app
+from tests.fakes import FakeGitHub
+
+HEADER = 'sleep_hours,rest_violations,ship_type,region,called_during_rest,port_intensity\n'
+
+
+def submission(sleep_hours, ship_type='Tanker'):
+    return f"{HEADER}{sleep_hours},1,{ship_type},Asia,No,Low\n".encode('utf-8')
+
+
+class GitHubTestCase(unittest.TestCase):
+    """Runs app.py against a FakeGitHub with fresh module state."""
+
+    files = {}
+
+    def setUp(self):
+        self.github = FakeGitHub(self.files)
+        self.addCleanup(self.github.close)
+        cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(cache_dir.cleanup)
+
+        patches = [
+            mock.patch.dict(os.environ, {'GITHUB_TOKEN': 'token', 'REPO_FULL_NAME': 'owner/repo'}),
+            mock.patch.object(app, 'github', app.GitHubClient(self.github.url, pool_size=4, retries=0)),
+            mock.patch.object(app, 'blob_cache', app.BlobCache(cache_dir.name, 1024 * 1024)),
+            mock.patch.object(app, 'INGEST_MODE', 'contents'),
+            mock.patch.object(app, '_aggregate_state', None),
+            mock.patch.object(app, '_aggregate_head', None),
+            mock.patch.object(app, '_branch_head', None),
+            mock.patch.object(app, '_committed_shas', {}),
+            mock.patch.object(app, '_dedup_shards', {}),
+            mock.patch.object(app, 'stats_cache', app.StatsCache(60, 600)),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def published(self):
+        return json.loads(self.github.files['data/data.json'])
+
+    def restart(self):
+        """Forget everything this instance knew, like a cold start."""
+        app._aggregate_state = app._aggregate_head = app._branch_head = None
+        app._committed_shas.clear()
+        app._dedup_shards.clear()
+
+
+class ArchiveIngestTest(GitHubTestCase):
+
+    files = {
+        'submissions/20250101_000000_a.csv': submission(7),
+        'submissions/20250102_000000_b.csv': submission(8),
+        'submissions/nested/20250103_000000_c.csv': submission(9),
+        'submissions/notes.txt': b'not a submission',
+        'README.md': b'# readme',
+    }
+
+    def test_streams_only_submission_csvs_from_the_tarball(self):
+        files = dict(app.iter_csv_files_from_archive())
+        self.assertEqual(sorted(files), ['20250101_000000_a.csv', '20250102_000000_b.csv'])
+        self.assertEqual(files['20250101_000000_a.csv'], submission(7).decode('utf-8'))
+        self.assertEqual(self.github.requested('GET', r'^/tarball/main$'), 1)
+
+    def test_matches_the_contents_listing(self):
+        from_archive = app.AggregateState.from_csv_files(app.iter_csv_files_from_archive())
+        from_contents = app.AggregateState.from_csv_files(app.get_csv_files_from_github())
+        self.assertEqual(from_archive.to_snapshot(), from_contents.to_snapshot())
+
+    def test_cached_blobs_are_not_downloaded_again(self):
+        first = app.get_csv_files_from_github()
+        downloads = self.github.requested('GET', r'^/git/blobs/')
+        self.assertEqual(downloads, 2)
+        self.assertEqual(app.get_csv_files_from_github(), first)
+        self.assertEqual(self.github.requested('GET', r'^/git/blobs/'), downloads)
+
+    def test_unchanged_listing_is_revalidated(self):
+        first = app.list_submission_files()
+        self.assertEqual(app.list_submission_files(), first)
+        self.assertEqual(self.github.not_modified, 1)
+        self.github.commit(dict(self.github.files, **{'submissions/20250104_000000_d.csv': submission(6)}))
+        self.assertEqual(len(app.list_submission_files()), 3)
+
+    def test_truncated_listing_falls_back_to_the_subtree(self):
+        self.github.truncated = True
+        paths = [entry['path'] for entry in app.list_submission_files()]
+        self.assertEqual(paths, ['submissions/20250101_000000_a.csv', 'submissions/20250102_000000_b.csv'])
+        self.assertEqual(self.github.requested('GET', r'^/git/trees/dir:submissions$'), 1)
+
+    def test_truncated_subtree_is_read_from_the_tarball(self):
+        self.github.truncated = True
+        self.github.truncated_subtrees.add('submissions')
+        with self.assertRaises(app.TruncatedListing):
+            app.list_submission_files()
+        self.assertEqual(app._aggregate_archive().files, 2)
+        self.assertEqual(self.github.requested('GET', r'^/tarball/main$'), 1)
+
+    def test_failed_download_raises(self):
+        self.github.fail('GET', r'^/tarball/main$', 502)
+        with self.assertRaises(requests.HTTPError):
+            list(app.iter_csv_files_from_archive())
+
+
+class CommitTest(GitHubTestCase):
+
+    files = {
+        'submissions/20250101_000000_a.csv': submission(7),
+        'submissions/20250102_000000_b.csv': submission(8),
+    }
+
+    def setUp(self):
+        super().setUp()
+        self.assertTrue(app.rebuild_aggregated_data())
+
+    def test_rebuild_publishes_data_and_state(self):
+        self.assertEqual(self.published()['totals']['submissions'], 2)
+        state = json.loads(self.github.files['data/state.json'])
+        self.assertEqual((state['files'], state['cursor']), (2, '20250102_000000_b.csv'))
+
+    def test_submission_and_aggregate_are_one_commit(self):
+        head = self.github.head
+        rows = [{'sleep_hours': '6', 'rest_violations': '1'}]
+        self.assertTrue(app.process_submission('c.csv', submission(6), rows))
+        self.assertEqual(self.github.commits[self.github.head][1], head)
+        names = [path for path in self.github.files if path.startswith('submissions/')]
+        self.assertEqual(len(names), 3)
+        self.assertEqual(self.published()['totals']['submissions'], 3)
+
+    def test_ref_conflict_is_retried_on_the_new_head(self):
+        def other_instance_commits():
+            files = dict(self.github.files)
+            files['submissions/20250103_000000_other.csv'] = submission(5)
+            state = app.AggregateState.from_csv_files(
+                (path.rpartition('/')[2], content.decode('utf-8'))
+                for path, content in sorted(files.items()) if path.startswith('submissions/'))
+            files.update(app._aggregate_files(state))
+            self.github.commit(files, "Another instance")
+
+        self.github.before_ref_update = other_instance_commits
+        updates = self.github.requested('PATCH', r'^/git/refs/heads/main$')
+        rows = [{'sleep_hours': '6', 'rest_violations': '1'}]
+        self.assertTrue(app.process_submission('c.csv', submission(6), rows))
+        self.assertEqual(self.github.requested('PATCH', r'^/git/refs/heads/main$') - updates, 2)
+        self.assertEqual(self.published()['totals']['submissions'], 4)
+        self.assertIn('submissions/20250103_000000_other.csv', self.github.files)
+
+    def test_concurrent_uploads_are_all_counted(self):
+        self.github.latency = 0.02
+        rows = [{'sleep_hours': '6', 'rest_violations': '1'}]
+        results = []
+        uploads = [
+            threading.Thread(target=lambda i=i: results.append(app.process_submission(f"{i}.csv", submission(6), rows)))
+            for i in range(8)
+        ]
+        for upload in uploads:
+            upload.start()
+        for upload in uploads:
+            upload.join()
+        self.assertEqual(results, [True] * 8)
+        names = [path for path in self.github.files if path.startswith('submissions/')]
+        self.assertEqual(len(names), 10)
+        self.assertEqual(self.published()['totals']['submissions'], 10)
+
+    def test_cold_instance_resumes_from_the_snapshot(self):
+        files = dict(self.github.files)
+        files['submissions/20250103_000000_late.csv'] = submission(5)
+        self.github.commit(files, "Added by hand")
+        self.restart()
+        blob_gets = self.github.requested('GET', r'^/git/blobs/')
+
+        rows = [{'sleep_hours': '6', 'rest_violations': '1'}]
+        self.assertTrue(app.process_submission('c.csv', submission(6), rows))
+        self.assertEqual(self.github.requested('GET', r'^/git/blobs/') - blob_gets, 1)
+        self.assertEqual(self.published()['totals']['submissions'], 4)
+
+    def test_listing_failure_aborts_the_commit(self):
+        self.restart()
+        head = self.github.head
+        self.github.fail('GET', r'^/git/trees/main$', 502)
+        rows = [{'sleep_hours': '6', 'rest_violations': '1'}]
+        self.assertFalse(app.process_submission('c.csv', submission(6), rows))
+        self.assertEqual(self.github.head, head)
+
+        self.assertTrue(app.process_submission('c.csv', submission(6), rows))
+        self.assertEqual(self.published()['totals']['submissions'], 3)
+
+    def test_download_failure_aborts_the_commit(self):
+        files = dict(self.github.files)
+        files['submissions/20250103_000000_late.csv'] = submission(5)
+        self.github.commit(files, "Added by hand")
+        self.restart()
+        head = self.github.head
+        self.github.fail('GET', r'^/git/blobs/', 502)
+        rows = [{'sleep_hours': '6', 'rest_violations': '1'}]
+        self.assertFalse(app.process_submission('c.csv', submission(6), rows))
+        self.assertEqual(self.github.head, head)
+
+
+class StatsTest(GitHubTestCase):
+
+    files = {'data/data.json': b'{"totals": {"submissions": 1}}'}
+    DATA = r'^/contents/data/data\.json'
+
+    def age(self, seconds):
+        """Make the cached copy look seconds old."""
+        app.stats_cache._fetched_at = time.monotonic() - seconds
+
+    def wait_for_refresh(self):
+        deadline = time.monotonic() + 5
+        while app.stats_cache._refreshing is not None and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def update(self, body):
+        self.github.commit(dict(self.github.files, **{'data/data.json': body}))
+
+    def test_cold_instances_share_one_fetch(self):
+        self.github.latency = 0.1
+        bodies = []
+        readers = [threading.Thread(target=lambda: bodies.append(app.stats_cache.get()[0])) for _ in range(6)]
+        for reader in readers:
+            reader.start()
+        for reader in readers:
+            reader.join()
+        self.assertEqual(bodies, [self.files['data/data.json']] * 6)
+        self.assertEqual(self.github.requested('GET', self.DATA), 1)
+
+    def test_stale_copy_is_served_while_one_refresh_runs(self):
+        app.stats_cache.get()
+        self.update(b'{"totals": {"submissions": 2}}')
+        self.age(61)
+        self.github.latency = 0.1
+        bodies = [app.stats_cache.get()[0] for _ in range(5)]
+        self.assertEqual(bodies, [self.files['data/data.json']] * 5)
+        self.wait_for_refresh()
+        self.assertEqual(self.github.requested('GET', self.DATA), 2)
+        self.assertEqual(app.stats_cache.get()[0], b'{"totals": {"submissions": 2}}')
+
+    def test_failed_refresh_backs_off_and_serves_the_stale_copy(self):
+        app.stats_cache.get()
+        self.age(3600)
+        self.github.fail('GET', self.DATA, 502, times=2)
+        self.assertEqual(app.stats_cache.get()[0], self.files['data/data.json'])
+        self.assertEqual(app.stats_cache.get()[0], self.files['data/data.json'])
+        self.assertEqual(self.github.requested('GET', self.DATA), 2)
+
+        app.stats_cache._retry_at = 0.0
+        app.stats_cache.get()
+        self.assertEqual(self.github.requested('GET', self.DATA), 3)
+        # The second failure in a row doubles the wait
+        self.assertGreater(app.stats_cache._retry_at - time.monotonic(), app.StatsCache.RETRY_MIN)
+
+    def test_published_body_is_served_without_asking_github(self):
+        app.stats_cache.publish(b'{"totals": {"submissions": 3}}')
+        body, etag = app.stats_cache.get()
+        self.assertEqual(body, b'{"totals": {"submissions": 3}}')
+        self.assertEqual(etag, app.git_blob_sha(body))
+        self.assertEqual(self.github.requested('GET', self.DATA), 0)
+
+    def test_matching_etag_is_not_modified(self):
+        client = app.app.test_client()
+        first = client.get('/stats')
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(first.data, self.files['data/data.json'])
+        self.assertIn('max-age=', first.headers['Cache-Control'])
+        second = client.get('/stats', headers={'If-None-Match': first.headers['ETag']})
+        self.assertEqual(second.status_code, 304)
+        self.assertEqual(second.data, b'')
+        self.assertEqual(self.github.requested('GET', self.DATA), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
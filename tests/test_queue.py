@@ -0,0 +1,93 @@
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+import app
+
+CSV = b'sleep_hours,rest_violations,ship_type,region,called_during_rest,port_intensity\n7,2,Gas,Asia,No,Low\n'
+ROWS = [{'sleep_hours': '7', 'rest_violations': '2'}]
+
+
+@unittest.skipIf(app.fcntl is None, "records are claimed with flock")
+class SubmissionQueueTest(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.processed = []
+        self.during_first = None
+
+        def process_submission(filename, content, rows, digest=None):
+            if not self.processed and self.during_first is not None:
+                self.during_first()
+            time.sleep(0.01)
+            self.processed.append(filename)
+            return True
+
+        # Records are drained explicitly, not by the background worker
+        patches = [
+            mock.patch.object(app, 'process_submission', process_submission),
+            mock.patch.object(app.SubmissionQueue, 'start'),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def queue(self):
+        return app.SubmissionQueue(self.directory)
+
+    def test_worker_skips_records_another_worker_holds_or_settled(self):
+        first, second = self.queue(), self.queue()
+        for i in range(3):
+            first.enqueue(f"{i}.csv", CSV, ROWS)
+        # The second worker drains while the first is committing its first record
+        self.during_first = second._drain
+        first._drain()
+        self.assertEqual(sorted(self.processed), ['0.csv', '1.csv', '2.csv'])
+
+    def test_workers_sharing_a_directory_process_each_record_once(self):
+        queue = self.queue()
+        ids = [queue.enqueue(f"{i}.csv", CSV, ROWS) for i in range(6)]
+        workers = [threading.Thread(target=self.queue()._drain) for _ in range(3)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.assertEqual(sorted(self.processed), [f"{i}.csv" for i in range(6)])
+        self.assertEqual({queue.get(i)['status'] for i in ids}, {'done'})
+        self.assertEqual(sorted(os.listdir(self.directory)), sorted(f"{i}.json" for i in ids))
+
+    def test_interrupted_record_is_picked_up_again(self):
+        queue = self.queue()
+        submission_id = queue.enqueue('a.csv', CSV, ROWS)
+        record = queue.get(submission_id)
+        record['status'] = 'processing'
+        queue._write(record)
+        self.queue()._drain()
+        self.assertEqual(self.processed, ['a.csv'])
+        self.assertEqual(queue.get(submission_id)['status'], 'done')
+
+    def test_record_claimed_by_a_live_worker_is_left_alone(self):
+        queue = self.queue()
+        submission_id = queue.enqueue('a.csv', CSV, ROWS)
+        with open(queue._lock_path(submission_id), 'w') as lock:
+            app.fcntl.flock(lock, app.fcntl.LOCK_EX)
+            self.queue()._drain()
+        self.assertEqual(self.processed, [])
+        self.assertEqual(queue.get(submission_id)['status'], 'queued')
+
+    def test_record_is_written_atomically(self):
+        queue = self.queue()
+        submission_id = queue.enqueue('a.csv', CSV, ROWS)
+        with open(queue._path(submission_id)) as f:
+            self.assertEqual(json.load(f)['filename'], 'a.csv')
+        self.assertEqual(os.listdir(self.directory), [f"{submission_id}.json"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,209 @@
+import ipaddress
+import os
+import tempfile
+import time
+import unittest
+
+import app
+from tests.fakes import FakeRedis
+
+HOST, NETWORK = 1, 2
+
+
+def limits(host=HOST, network_limit=3):
+    return [(host, 1), (NETWORK, network_limit)]
+
+
+def key(prefix, network):
+    return prefix << 128 | int(ipaddress.ip_address(network))
+
+
+class RateLimitKeysTest(unittest.TestCase):
+
+    def test_ipv4_is_counted_per_address_and_per_24(self):
+        self.assertEqual(app.rate_limit_keys('192.0.2.77'), [
+            (key(32, '192.0.2.77'), 1),
+            (key(24, '192.0.2.0'), app.RATE_LIMIT_NETWORK_MAX),
+        ])
+
+    def test_ipv6_is_counted_per_64_and_per_48(self):
+        self.assertEqual(app.rate_limit_keys('2001:db8:1:2:3:4:5:6'), [
+            (key(64, '2001:db8:1:2::'), 1),
+            (key(48, '2001:db8:1::'), app.RATE_LIMIT_NETWORK_MAX),
+        ])
+        # Addresses inside one /64 are one host
+        self.assertEqual(app.rate_limit_keys('2001:db8:1:2::ffff')[0], app.rate_limit_keys('2001:db8:1:2::1')[0])
+
+    def test_ipv4_mapped_addresses_count_as_ipv4(self):
+        self.assertEqual(app.rate_limit_keys('::ffff:192.0.2.77'), app.rate_limit_keys('192.0.2.77'))
+
+    def test_levels_of_different_families_do_not_collide(self):
+        # 0.0.0.0/24 and ::/24 would share a network value without the prefix
+        self.assertNotEqual(app.rate_limit_keys('0.0.0.1')[1][0], app.rate_limit_keys('::1')[1][0])
+
+    def test_unparseable_address_gets_its_own_key(self):
+        keys = app.rate_limit_keys('unknown')
+        self.assertEqual(len(keys), 1)
+        self.assertEqual(keys[0][1], 1)
+        self.assertNotEqual(keys, app.rate_limit_keys('other'))
+
+
+class ExpiringStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.store = app.ExpiringStore(ttl=60, max_entries=100)
+
+    def acquire(self, address, now=0):
+        return self.store.acquire(app.rate_limit_keys(address), now=now)
+
+    def test_network_limit_applies_across_hosts(self):
+        hosts = [f"192.0.2.{i}" for i in range(1, app.RATE_LIMIT_NETWORK_MAX + 2)]
+        admitted = [self.acquire(host) == 0 for host in hosts]
+        self.assertEqual(admitted, [True] * app.RATE_LIMIT_NETWORK_MAX + [False])
+        self.assertEqual(self.acquire('198.51.100.1'), 0)
+
+    def test_rejection_counts_nothing(self):
+        self.store.acquire(limits(), now=0)
+        counts = {key: entry[1] for key, entry in self.store._entries.items()}
+        self.assertEqual(self.store.acquire(limits(), now=10), 50)
+        self.assertEqual({key: entry[1] for key, entry in self.store._entries.items()}, counts)
+
+    def test_window_expires(self):
+        self.assertEqual(self.acquire('192.0.2.1', now=0), 0)
+        self.assertEqual(self.acquire('192.0.2.1', now=59), 1)
+        self.assertEqual(self.acquire('192.0.2.1', now=60), 0)
+
+    def test_expired_entries_are_swept_lazily(self):
+        self.acquire('192.0.2.1', now=0)
+        self.acquire('198.51.100.1', now=30)
+        self.assertEqual(len(self.store), 4)
+        self.acquire('203.0.113.1', now=61)
+        self.assertEqual(len(self.store), 4)
+        self.assertNotIn(app.rate_limit_keys('192.0.2.1')[0][0], self.store._entries)
+
+    def test_oldest_entries_are_evicted_beyond_max_entries(self):
+        store = app.ExpiringStore(ttl=60, max_entries=3)
+        for host in (1, 3, 4):
+            store.acquire(limits(host, network_limit=10), now=host)
+        self.assertEqual(len(store), 3)
+        self.assertEqual(list(store._entries), [NETWORK, 3, 4])
+        # The evicted host is let back in early rather than refusing everyone else
+        self.assertEqual(store.acquire(limits(1, network_limit=10), now=5), 0)
+
+
+class RedisRateLimiterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.redis = FakeRedis(password='secret')
+        self.addCleanup(self.redis.close)
+        self.limiter = app.RedisRateLimiter(
+            self.redis.url.replace('redis://', 'redis://:secret@') + '/2', ttl=60)
+        self.addCleanup(self.limiter._close)
+
+    def test_counts_every_level_and_rejects_when_exhausted(self):
+        self.assertEqual(self.limiter.acquire(limits()), 0)
+        wait = self.limiter.acquire(limits())
+        self.assertGreater(wait, 0)
+        self.assertLessEqual(wait, 60)
+        self.assertEqual(self.redis.store[f"ratelimit:{HOST:x}"][0], '1')
+        self.assertEqual(self.redis.store[f"ratelimit:{NETWORK:x}"][0], '1')
+
+    def test_rejected_requests_do_not_use_up_the_network(self):
+        self.limiter.acquire(limits())
+        for _ in range(5):
+            self.assertGreater(self.limiter.acquire(limits()), 0)
+        admitted = [self.limiter.acquire(limits(host)) == 0 for host in (10, 11, 12)]
+        self.assertEqual(admitted, [True, True, False])
+
+    def test_window_expires(self):
+        limiter = app.RedisRateLimiter(self.redis.url, ttl=0.2)
+        self.addCleanup(limiter._close)
+        self.assertEqual(limiter.acquire(limits()), 0)
+        self.assertGreater(limiter.acquire(limits()), 0)
+        time.sleep(0.3)
+        self.assertEqual(limiter.acquire(limits()), 0)
+
+    def test_counter_without_expiry_gets_a_window(self):
+        self.redis.store[f"ratelimit:{HOST:x}"] = ['-1', None]
+        self.assertEqual(self.limiter.acquire(limits()), 0)
+        self.assertIsNotNone(self.redis.store[f"ratelimit:{HOST:x}"][1])
+
+    def test_reconnects_after_idle_close_without_resending(self):
+        self.limiter.acquire(limits())
+        self.redis.drop_connections()
+        time.sleep(0.1)
+        self.assertEqual(self.limiter.acquire(limits(host=3)), 0)
+        self.assertEqual(sum(1 for command in self.redis.commands if command[0] == 'EXEC'), 2)
+
+    def test_batch_is_not_resent_after_it_was_sent(self):
+        self.limiter.acquire(limits())
+        self.redis.hang_up = 1
+        with self.assertRaises(ConnectionError):
+            self.limiter.acquire(limits(host=3))
+        self.assertEqual(sum(1 for command in self.redis.commands if command[0] == 'MULTI'), 2)
+
+    def test_wrong_password_is_an_error(self):
+        limiter = app.RedisRateLimiter(self.redis.url.replace('redis://', 'redis://:wrong@'), ttl=60)
+        self.addCleanup(limiter._close)
+        with self.assertRaises(app.RedisError):
+            limiter.acquire(limits())
+
+
+class SQLiteRateLimiterTest(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'ratelimit.sqlite3')
+
+    def test_window_expires(self):
+        limiter = app.SQLiteRateLimiter(self.path, ttl=0.2)
+        self.assertEqual(limiter.acquire(limits()), 0)
+        self.assertGreater(limiter.acquire(limits()), 0)
+        time.sleep(0.3)
+        self.assertEqual(limiter.acquire(limits()), 0)
+
+    def test_counters_are_shared_through_the_file(self):
+        first = app.SQLiteRateLimiter(self.path, ttl=60)
+        second = app.SQLiteRateLimiter(self.path, ttl=60)
+        self.assertEqual(first.acquire(limits()), 0)
+        self.assertGreater(second.acquire(limits()), 0)
+        self.assertEqual(second.acquire(limits(host=3)), 0)
+        self.assertEqual(first.acquire(limits(host=4)), 0)
+        self.assertGreater(second.acquire(limits(host=5)), 0)
+
+    def test_expired_rows_are_purged(self):
+        limiter = app.SQLiteRateLimiter(self.path, ttl=0.1)
+        limiter.PURGE_EVERY = 2
+        limiter.acquire(limits())
+        time.sleep(0.2)
+        limiter.acquire(limits(host=3, network_limit=1))
+        rows = limiter._db.execute("SELECT count(*) FROM rate_limit_counters").fetchone()[0]
+        self.assertEqual(rows, 2)
+
+
+class CachedRateLimiterTest(unittest.TestCase):
+
+    def test_falls_back_to_memory_when_the_backend_is_down(self):
+        redis = FakeRedis()
+        url = redis.url
+        redis.close()
+        limiter = app.CachedRateLimiter(app.RedisRateLimiter(url, ttl=60), app.ExpiringStore(60, 10))
+        self.assertEqual(limiter.acquire(limits()), 0)
+        self.assertGreater(limiter.acquire(limits()), 0)
+
+    def test_remembers_rejections(self):
+        redis = FakeRedis()
+        self.addCleanup(redis.close)
+        backend = app.RedisRateLimiter(redis.url, ttl=60)
+        self.addCleanup(backend._close)
+        limiter = app.CachedRateLimiter(backend, app.ExpiringStore(60, 10))
+        limiter.acquire(limits())
+        limiter.acquire(limits())
+        sent = len(redis.commands)
+        self.assertGreater(limiter.acquire(limits()), 0)
+        self.assertEqual(len(redis.commands), sent)
+
+
+if __name__ == '__main__':
+    unittest.main()
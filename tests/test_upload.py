@@ -0,0 +1,94 @@
+import io
+import unittest
+from unittest import mock
+
+from werkzeug.datastructures import FileStorage, MultiDict
+from werkzeug.test import encode_multipart
+
+import app
+
+CSV = b'sleep_hours,rest_violations,ship_type,region,called_during_rest,port_intensity\n7,2,Gas,Asia,No,Low\n'
+
+
+class StreamingUploadTest(unittest.TestCase):
+
+    def parse(self, fields, chunk_size=64 * 1024):
+        boundary, body = encode_multipart(fields, boundary='----boundary')
+        upload = app.StreamingUpload(io.BytesIO(body), boundary.encode('latin-1'), 'submission', chunk_size)
+        chunks = list(upload.file_chunks())
+        return upload, chunks
+
+    def test_streams_the_file_and_collects_fields(self):
+        upload, chunks = self.parse({
+            'website': 'x',
+            'submission': FileStorage(io.BytesIO(CSV), 'report.csv'),
+            'comment': 'abc',
+        })
+        self.assertEqual(b''.join(chunks), CSV)
+        self.assertEqual(bytes(upload.content), CSV)
+        self.assertEqual(upload.filename, 'report.csv')
+        self.assertEqual(upload.fields, {'website': 'x', 'comment': 'abc'})
+
+    def test_file_larger_than_a_read_arrives_in_chunks(self):
+        content = CSV + b'6,1,Tanker,Europe,Yes,High\n' * 2000
+        upload, chunks = self.parse({'submission': FileStorage(io.BytesIO(content), 'big.csv')}, chunk_size=4096)
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual(bytes(upload.content), content)
+
+    def test_only_the_first_file_field_is_kept(self):
+        upload, _ = self.parse(MultiDict([
+            ('submission', FileStorage(io.BytesIO(CSV), 'a.csv')),
+            ('submission', FileStorage(io.BytesIO(CSV.replace(b'7,2', b'9,9')), 'b.csv')),
+        ]))
+        self.assertEqual((upload.filename, bytes(upload.content)), ('a.csv', CSV))
+
+
+class TextLinesTest(unittest.TestCase):
+
+    def test_splits_lines_across_chunks_and_multibyte_characters(self):
+        data = 'a,b\nRéunion,Ålesund\nlast'.encode('utf-8')
+        chunks = [data[i:i + 3] for i in range(0, len(data), 3)]
+        self.assertEqual(list(app.iter_text_lines(chunks)), ['a,b\n', 'Réunion,Ålesund\n', 'last'])
+
+    def test_rejects_invalid_utf8(self):
+        with self.assertRaises(UnicodeDecodeError):
+            list(app.iter_text_lines([b'ok\n\xff\n']))
+
+
+class UploadAdmissionTest(unittest.TestCase):
+
+    def setUp(self):
+        patch = mock.patch.object(app, 'rate_limit_store', app.ExpiringStore(60, 100))
+        patch.start()
+        self.addCleanup(patch.stop)
+        self.client = app.app.test_client()
+
+    def test_missing_length_is_rejected(self):
+        response = self.client.post('/upload', environ_overrides={'CONTENT_LENGTH': ''})
+        self.assertEqual(response.status_code, 411)
+
+    def test_oversized_upload_is_rejected_before_the_body_is_read(self):
+        limit = app.app.config['MAX_CONTENT_LENGTH']
+        body = mock.Mock(spec=io.BytesIO)
+        response = self.client.post(
+            '/upload', headers={'Origin': app.ALLOWED_ORIGINS[0]},
+            environ_overrides={'CONTENT_LENGTH': str(limit + 1), 'wsgi.input': body},
+        )
+        self.assertEqual(response.status_code, 413)
+        self.assertEqual(response.headers['Access-Control-Allow-Origin'], app.ALLOWED_ORIGINS[0])
+        body.read.assert_not_called()
+
+    def test_second_upload_from_an_address_is_rate_limited(self):
+        with mock.patch.object(app, 'process_submission', return_value=True):
+            first = self.client.post(
+                '/upload', data={'submission': (io.BytesIO(CSV), 'a.csv')},
+                environ_overrides={'REMOTE_ADDR': '192.0.2.1'})
+            second = self.client.post(
+                '/upload', data={'submission': (io.BytesIO(CSV), 'a.csv')},
+                environ_overrides={'REMOTE_ADDR': '192.0.2.1'})
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(second.status_code, 429)
+
+
+if __name__ == '__main__':
+    unittest.main()